@@ -4,11 +4,14 @@ LLM交互核心模块 - 处理与大语言模型的通信逻辑
 用于知识图谱的智能扩展和编辑
 """
 
+import asyncio
+import hashlib
 import json
 import requests
-from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, Optional, List
 from config import DEFAULT_MODEL, OLLAMA_URL, REMOTE_API_KEY, REMOTE_BASE_URL
-from rag.graph_types import LLMGraphResponse, LLMGraphNode, LLMGraphRelationship
+from rag.graph_types import LLMGraphResponse, LLMGraphNode, LLMGraphRelationship, ContextSummary
 from langchain.prompts import PromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 import logging
@@ -16,9 +19,39 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+GRAPH_PROMPT_TEMPLATE = """
+    你是一个专业的知识图谱构建专家。请根据要求生成知识图谱数据。
+
+    当前节点信息：
+    节点ID: {node_id}
+    节点标签: {node_label}
+    节点类型: {node_type}
+    节点属性: {node_properties}
+
+    用户提示词: {user_question}
+
+    {context_info}
+
+    输出要求：
+    1. 严格按照指定的JSON格式输出
+    2. 新生成的节点和关系必须与原始节点有逻辑关联
+    3. 节点的properties中必须包含content字段存储相关内容
+    4. 关系的properties中必须包含content字段存储关系说明
+    5. 确保生成的数据语义合理、逻辑清晰
+
+    请严格按照以下JSON格式输出：
+    {format_instructions}
+"""
+
+
 class LLMInteractionManager:
     """LLM交互管理器"""
 
+    # 语义化提问模板
+    EXPLAIN_MEANING_QUESTION = "请详细解释这个节点的含义或定义，它代表什么概念？在相关领域中如何被理解？"
+    ANALYZE_JUSTIFICATION_QUESTION = "请分析这个节点背后的理据、支撑依据或论证逻辑，为什么它成立或被提出？"
+    EXPLORE_POSSIBILITY_QUESTION = "请推测这个节点可能的发展方向、潜在关联或未来可能性，有哪些合理的延伸？"
+
     def __init__(
             self,
             default_model: Optional[str] = None,
@@ -40,8 +73,29 @@ class LLMInteractionManager:
         self.remote_api_key = remote_api_key or REMOTE_API_KEY
         self.remote_base_url = remote_base_url or REMOTE_BASE_URL
 
+        # 复用连接池，避免每次调用都重新建立 TCP 连接
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64, pool_block=False)
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
+
+        # 解析器与提示词模板只构建一次；热路径直接用 str.format_map 填充，绕过 PromptTemplate 的校验开销
+        self._parser = PydanticOutputParser(pydantic_object=LLMGraphResponse)
+        self._format_instructions = self._parser.get_format_instructions()
+        self._prompt_template = PromptTemplate(
+            template=GRAPH_PROMPT_TEMPLATE,
+            input_variables=["node_id", "node_label", "node_type", "node_properties", "user_question",
+                             "context_info"],
+            partial_variables={"format_instructions": self._format_instructions}
+        )
+        self._prompt_str = self._prompt_template.template
+
+        # 正在进行中的异步请求：提示词摘要 -> Future
+        self._inflight: Dict[str, asyncio.Future] = {}
+
     def generate_graph_from_question(self, node: Dict[str, Any], question: str,
-                                     context_graph: Optional[Dict[str, Any]] = None) -> LLMGraphResponse:
+                                     context_graph: Optional[Dict[str, Any]] = None,
+                                     context_summary: Optional[ContextSummary] = None) -> LLMGraphResponse:
         """
         通用接口：根据节点信息 + 自然语言问题，生成关联的新节点和关系图谱。
 
@@ -50,68 +104,99 @@ class LLMInteractionManager:
         :param node: 当前节点信息
         :param question: 用户提出的具体问题（自然语言）
         :param context_graph: 上下文图谱（可选）
+        :param context_summary: 预先计算好的上下文摘要（可选，优先于 context_graph）
         :return: 生成的知识图谱响应
         """
         try:
-            # 创建 Pydantic 输出解析器
-            parser = PydanticOutputParser(pydantic_object=LLMGraphResponse)
-
-            # 创建提示词模板
-            prompt_template = PromptTemplate(
-                template="""
-                    你是一个专业的知识图谱构建专家。请根据要求生成知识图谱数据。
-
-                    当前节点信息：
-                    节点ID: {node_id}
-                    节点标签: {node_label}
-                    节点类型: {node_type}
-                    节点属性: {node_properties}
-
-                    用户提示词: {user_question}
-
-                    {context_info}
-
-                    输出要求：
-                    1. 严格按照指定的JSON格式输出
-                    2. 新生成的节点和关系必须与原始节点有逻辑关联
-                    3. 节点的properties中必须包含content字段存储相关内容
-                    4. 关系的properties中必须包含content字段存储关系说明
-                    5. 确保生成的数据语义合理、逻辑清晰
-
-                    请严格按照以下JSON格式输出：
-                    {format_instructions}
-                    """,
-                input_variables=["node_id", "node_label", "node_type", "node_properties", "user_question",
-                                 "context_info"],
-                partial_variables={"format_instructions": parser.get_format_instructions()}
+            formatted_prompt = self._build_prompt(node, question, context_graph, context_summary)
+        except Exception as e:
+            logger.error("生成图谱时出错: %s", e)
+            return LLMGraphResponse(
+                nodes=[],
+                relationships=[],
+                error=f"处理失败: {str(e)}"
             )
+        return self._generate_from_prompt(formatted_prompt)
 
-            # 准备输入变量
-            context_info = ""
-            if context_graph:
-                context_info = f"上下文图谱信息：节点数: {len(context_graph.get('nodes', []))}, 关系数: {len(context_graph.get('relationships', []))}"
-
-            # 生成提示词
-            formatted_prompt = prompt_template.format(
-                node_id=node.get('id', ''),
-                node_label=node.get('label', node.get('id', '')),
-                node_type=node.get('type', ''),
-                node_properties=json.dumps(node.get('properties', {}), ensure_ascii=False),
-                user_question=question,
-                context_info=context_info
+    async def agenerate_graph_from_question(self, node: Dict[str, Any], question: str,
+                                            context_graph: Optional[Dict[str, Any]] = None,
+                                            context_summary: Optional[ContextSummary] = None) -> LLMGraphResponse:
+        """
+        generate_graph_from_question 的异步版本。
+
+        相同提示词的并发请求会被合并：后到的调用直接等待正在进行的那一次，不会重复请求 LLM。
+        """
+        try:
+            formatted_prompt = self._build_prompt(node, question, context_graph, context_summary)
+        except Exception as e:
+            logger.error("生成图谱时出错: %s", e)
+            return LLMGraphResponse(
+                nodes=[],
+                relationships=[],
+                error=f"处理失败: {str(e)}"
             )
 
+        key = hashlib.blake2b(formatted_prompt.encode('utf-8'), digest_size=16).hexdigest()
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await asyncio.to_thread(self._generate_from_prompt, formatted_prompt)
+            fut.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # 标记异常已被读取，避免无人等待时出现 "exception was never retrieved" 警告
+            fut.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _build_prompt(self, node: Dict[str, Any], question: str,
+                      context_graph: Optional[Dict[str, Any]] = None,
+                      context_summary: Optional[ContextSummary] = None) -> str:
+        """根据节点信息、问题和上下文生成完整提示词"""
+        nid = node.get('id', '')
+
+        # 准备输入变量
+        if context_summary is None and context_graph:
+            context_summary = ContextSummary.from_graph(context_graph, nid)
+        context_info = context_summary.to_prompt() if context_summary else ""
+
+        # 生成提示词
+        return self._prompt_str.format_map({
+            "node_id": nid,
+            "node_label": node.get('label', nid),
+            "node_type": node.get('type', ''),
+            "node_properties": json.dumps(node.get('properties', {}), ensure_ascii=False),
+            "user_question": question,
+            "context_info": context_info,
+            "format_instructions": self._format_instructions
+        })
+
+    def _generate_from_prompt(self, formatted_prompt: str) -> LLMGraphResponse:
+        """调用 LLM 并把响应解析为图谱"""
+        try:
             # 调用LLM
             llm_response = self._call_ollama(formatted_prompt)
 
             # 清理响应（处理可能的思考过程）
-            think_index = llm_response.find("</think>")
-            if think_index != -1:
-                llm_response = llm_response[think_index + len("</think>"):]
-
-            # 解析响应
+            _, sep, tail = llm_response.partition("</think>")
+            if sep:
+                llm_response = tail
+
+            # 解析响应：先直接提取 JSON 并校验，仅在失败时才走 PydanticOutputParser
+            fast_result = self._fast_parse_response(llm_response)
+            if fast_result is not None:
+                return fast_result
             try:
-                parsed_result = parser.invoke(llm_response)
+                parsed_result = self._parser.invoke(llm_response)
                 if isinstance(parsed_result, dict):
                     return LLMGraphResponse(**parsed_result)
                 elif isinstance(parsed_result, LLMGraphResponse):
@@ -119,11 +204,11 @@ class LLMInteractionManager:
                 else:
                     return LLMGraphResponse(**parsed_result.dict())
             except Exception as parse_error:
-                logger.warning(f"Pydantic解析失败，尝试手动解析: {parse_error}")
+                logger.warning("Pydantic解析失败，尝试手动解析: %s", parse_error)
                 return self._manual_parse_response(llm_response)
 
         except Exception as e:
-            logger.error(f"生成图谱时出错: {e}")
+            logger.error("生成图谱时出错: %s", e)
             return LLMGraphResponse(
                 nodes=[],
                 relationships=[],
@@ -142,24 +227,72 @@ class LLMInteractionManager:
         """
         提问：“X是什么意思？” → 请求定义或解释
         """
-        question = "请详细解释这个节点的含义或定义，它代表什么概念？在相关领域中如何被理解？"
-        return self.generate_graph_from_question(node, question, context_graph)
+        return self.generate_graph_from_question(node, self.EXPLAIN_MEANING_QUESTION, context_graph)
 
     def analyze_justification(self, node: Dict[str, Any],
                               context_graph: Optional[Dict[str, Any]] = None) -> LLMGraphResponse:
         """
         提问：“X有什么理据？” → 请求理由、依据、论证
         """
-        question = "请分析这个节点背后的理据、支撑依据或论证逻辑，为什么它成立或被提出？"
-        return self.generate_graph_from_question(node, question, context_graph)
+        return self.generate_graph_from_question(node, self.ANALYZE_JUSTIFICATION_QUESTION, context_graph)
 
     def explore_possibility(self, node: Dict[str, Any],
                             context_graph: Optional[Dict[str, Any]] = None) -> LLMGraphResponse:
         """
         提问：“X有什么可能性？” → 请求推测、推演、潜在发展
         """
-        question = "请推测这个节点可能的发展方向、潜在关联或未来可能性，有哪些合理的延伸？"
-        return self.generate_graph_from_question(node, question, context_graph)
+        return self.generate_graph_from_question(node, self.EXPLORE_POSSIBILITY_QUESTION, context_graph)
+
+    async def ask_all(self, node: Dict[str, Any],
+                      context_graph: Optional[Dict[str, Any]] = None,
+                      questions: Optional[List[str]] = None,
+                      max_concurrency: int = 3) -> List[LLMGraphResponse]:
+        """
+        并发提出多个语义化问题（默认：含义、理据、可能性），按提问顺序返回各自的响应。
+
+        :param node: 当前节点信息
+        :param context_graph: 上下文图谱（可选）
+        :param questions: 问题列表，缺省时使用三个内置语义化问题
+        :param max_concurrency: 同时进行的 LLM 请求数上限
+        :return: 与 questions 一一对应的响应列表，可用 merge_responses 合并
+        """
+        if questions is None:
+            questions = [
+                self.EXPLAIN_MEANING_QUESTION,
+                self.ANALYZE_JUSTIFICATION_QUESTION,
+                self.EXPLORE_POSSIBILITY_QUESTION,
+            ]
+        sem = asyncio.Semaphore(max_concurrency)
+
+        # 上下文摘要只计算一次，供所有问题共享
+        context_summary = ContextSummary.from_graph(context_graph, node.get('id')) if context_graph else None
+
+        async def _bounded(question: str) -> LLMGraphResponse:
+            async with sem:
+                return await self.agenerate_graph_from_question(node, question, context_summary=context_summary)
+
+        # 先提交全部任务再统一等待，避免逐个 await 退化为串行
+        tasks = [asyncio.create_task(_bounded(q)) for q in questions]
+        return await asyncio.gather(*tasks)
+
+    @staticmethod
+    def merge_responses(responses: List[LLMGraphResponse]) -> LLMGraphResponse:
+        """合并多个图谱响应：节点按 id 去重，关系按 (source_id, target_id, type) 去重"""
+        nodes: Dict[str, LLMGraphNode] = {}
+        relationships: Dict[tuple, LLMGraphRelationship] = {}
+        errors = []
+        for response in responses:
+            for node in response.nodes:
+                nodes.setdefault(node.id, node)
+            for rel in response.relationships:
+                relationships.setdefault((rel.source_id, rel.target_id, rel.type), rel)
+            if response.error:
+                errors.append(response.error)
+        return LLMGraphResponse(
+            nodes=list(nodes.values()),
+            relationships=list(relationships.values()),
+            error="; ".join(errors) if errors else None
+        )
 
     def _call_ollama(self, prompt: str) -> str:
         """调用Ollama API"""
@@ -173,17 +306,30 @@ class LLMInteractionManager:
                 "options": {"temperature": 0.8, "num_ctx": 4096}
             }
 
-            logger.info(f"调用Ollama模型: {self.default_model} @ {self.ollama_base_url}")
-            response = requests.post(url, json=payload, timeout=300)
+            logger.info("调用Ollama模型: %s @ %s", self.default_model, self.ollama_base_url)
+            response = self._http.post(url, json=payload, timeout=300)
             response.raise_for_status()
 
             result = response.json()
             return result.get('response', '')
 
         except Exception as e:
-            logger.error(f"调用Ollama失败: {e}")
+            logger.error("调用Ollama失败: %s", e)
             raise
 
+    @staticmethod
+    def _fast_parse_response(response: str) -> Optional[LLMGraphResponse]:
+        """快速解析：截取最外层 {} 并直接校验为 LLMGraphResponse，失败返回 None"""
+        start = response.find('{')
+        end = response.rfind('}') + 1
+        if start == -1 or end <= start:
+            return None
+        try:
+            return LLMGraphResponse(**json.loads(response[start:end]))
+        except Exception as e:
+            logger.debug("快速解析失败，回退到 Pydantic 解析器: %s", e)
+            return None
+
     def _manual_parse_response(self, response: str) -> LLMGraphResponse:
         """手动解析LLM响应"""
         try:
@@ -205,25 +351,25 @@ class LLMInteractionManager:
             # 转换节点数据，确保有content字段
             nodes = []
             for node_data in nodes_data:
-                properties = node_data.get('properties', {})
-                if 'content' not in properties:
-                    properties['content'] = f"{node_data.get('type', '')}相关信息"
+                node_type = node_data.get('type', '')
+                properties = node_data.setdefault('properties', {})
+                properties.setdefault('content', f"{node_type}相关信息")
                 nodes.append(LLMGraphNode(
                     id=node_data.get('id', ''),
-                    type=node_data.get('type', ''),
+                    type=node_type,
                     properties=properties
                 ))
 
             # 转换关系数据，确保有content字段
             relationships = []
             for rel_data in relationships_data:
-                properties = rel_data.get('properties', {})
-                if 'content' not in properties:
-                    properties['content'] = f"{rel_data.get('type', '')}关系说明"
+                rel_type = rel_data.get('type', '')
+                properties = rel_data.setdefault('properties', {})
+                properties.setdefault('content', f"{rel_type}关系说明")
                 relationships.append(LLMGraphRelationship(
                     source_id=rel_data.get('source_id', ''),
                     target_id=rel_data.get('target_id', ''),
-                    type=rel_data.get('type', ''),
+                    type=rel_type,
                     properties=properties
                 ))
 
@@ -233,7 +379,7 @@ class LLMInteractionManager:
             )
 
         except Exception as e:
-            logger.error(f"手动解析响应失败: {e}")
+            logger.error("手动解析响应失败: %s", e)
             return LLMGraphResponse(
                 nodes=[],
                 relationships=[],
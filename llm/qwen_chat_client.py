@@ -1,16 +1,30 @@
 # qwen_chat_client.py
 import atexit
-import glob
+import functools
 import json
 import time
 import tempfile
-import html2text
 import re
 import os
+import queue
 import shutil
-from bs4 import BeautifulSoup
+import threading
+import weakref
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时只用标准库 json
+    orjson = None
+try:
+    import lxml.html
+except ImportError:  # 未安装 lxml 时用 BeautifulSoup 预处理
+    lxml = None
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:  # 未安装 selectolax 时回退到 BeautifulSoup + html2text
+    HTMLParser = None
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -19,56 +33,246 @@ from selenium.common.exceptions import (
     TimeoutException,
     StaleElementReferenceException,
     ElementClickInterceptedException,
+    WebDriverException,
 )
-import uuid
 
 
 def cleanup_temp_profiles():
+    """
+    删除临时目录下所有 qwen_selenium_profile_* 目录（手动清理历史残留用）。
+    不在退出时自动调用：它会误删同一台机器上其他进程仍在使用的目录，
+    各实例的临时目录由 _dispose_driver 在浏览器退出后单独删除。
+    """
     temp_dir = tempfile.gettempdir()
-    pattern = os.path.join(temp_dir, "qwen_selenium_profile_*")
-    for folder in glob.glob(pattern):
+    prefix = "qwen_selenium_profile_"
+    try:
+        with os.scandir(temp_dir) as it:
+            for entry in it:
+                if entry.name.startswith(prefix) and entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    # print(f"[清理] 已删除临时目录: {entry.path}")
+    except OSError:
+        pass
+
+
+# --- 浏览器驱动池 ---
+# close() 时不退出 Chrome，而是换一个空白标签页后放回池中，下一个客户端直接复用，
+# 省去 Chrome 冷启动和临时用户目录的创建。按 (headless, driver_path) 分池。
+DRIVER_POOL_SIZE = 4
+_DRIVER_POOLS = {}
+_DRIVER_POOLS_LOCK = threading.Lock()
+
+
+def _get_driver_pool(key):
+    with _DRIVER_POOLS_LOCK:
+        pool = _DRIVER_POOLS.get(key)
+        if pool is None:
+            pool = _DRIVER_POOLS[key] = queue.Queue(maxsize=DRIVER_POOL_SIZE)
+        return pool
+
+
+def _dispose_driver(driver, user_data_dir):
+    """退出浏览器并回收其用户数据目录：临时目录直接删除，持久化目录只释放占用标记。"""
+    if driver is not None:
         try:
-            shutil.rmtree(folder)
-            # print(f"[清理] 已删除临时目录: {folder}")
-        except Exception as e:
-            # print(f"[清理警告] 无法删除 {folder}: {e}")
+            driver.quit()
+        except Exception:
+            pass
+    if not user_data_dir:
+        return
+    if user_data_dir == QwenChatClient.PERSISTENT_PROFILE_DIR:
+        _release_persistent_profile()
+    else:
+        shutil.rmtree(user_data_dir, ignore_errors=True)
+
+
+def shutdown_driver_pools():
+    """退出池中所有空闲的浏览器（解释器退出时调用）。"""
+    with _DRIVER_POOLS_LOCK:
+        pools = list(_DRIVER_POOLS.values())
+    for pool in pools:
+        while True:
+            try:
+                driver, user_data_dir = pool.get_nowait()
+            except queue.Empty:
+                break
+            _dispose_driver(driver, user_data_dir)
+
+
+atexit.register(shutdown_driver_pools)
+
+# 持久化用户目录同一时间只能被一个 Chrome 进程使用，记录当前占用情况
+_PERSISTENT_PROFILE_LOCK = threading.Lock()
+_persistent_profile_in_use = False
+
+
+def _claim_persistent_profile():
+    global _persistent_profile_in_use
+    with _PERSISTENT_PROFILE_LOCK:
+        if _persistent_profile_in_use:
+            return False
+        _persistent_profile_in_use = True
+        return True
+
+
+def _release_persistent_profile():
+    global _persistent_profile_in_use
+    with _PERSISTENT_PROFILE_LOCK:
+        _persistent_profile_in_use = False
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+@functools.lru_cache(maxsize=None)
+def _split_locators(locators: tuple):
+    """把 (By, locator) 元组按类型拆成 CSS 选择器列表和 XPath 列表，结果按定位器元组缓存。"""
+    css_selectors = [locator for by, locator in locators if by == By.CSS_SELECTOR]
+    xpaths = [locator for by, locator in locators if by == By.XPATH]
+    return css_selectors, xpaths
+
+
+# 回复中需要移除的界面元素（底部按钮区、引用标记）
+REPLY_NOISE_SELECTORS = ".seletected-text-content, .citation-button-wrap, script, style"
+_BLOCK_TAGS = frozenset({
+    "p", "div", "br", "li", "ul", "ol", "pre", "blockquote", "table", "tr", "hr",
+    "h1", "h2", "h3", "h4", "h5", "h6",
+})
+_EXTRA_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def html_to_text(html_content: str) -> str:
+    """
+    用 selectolax 一次解析 HTML：移除界面噪声元素后按块级元素换行输出纯文本。
+    需要安装 selectolax。
+    """
+    tree = HTMLParser(html_content)
+    for node in tree.css(REPLY_NOISE_SELECTORS):
+        node.decompose()
+    root = tree.body or tree.root
+    if root is None:
+        return ""
+    parts = []
+    for node in root.traverse(include_text=True):
+        tag = node.tag
+        if tag == "-text":
+            parts.append(node.text(deep=False))
+        elif tag == "li":
+            parts.append("\n- ")
+        elif tag in _BLOCK_TAGS:
+            parts.append("\n")
+    return _EXTRA_BLANK_LINES_RE.sub("\n\n", "".join(parts)).strip()
+
+
+# lxml 预处理时匹配的噪声元素（与 REPLY_NOISE_SELECTORS 中的两个 class 对应）
+_REPLY_NOISE_XPATH = (
+    "//*[contains(concat(' ', normalize-space(@class), ' '), ' seletected-text-content ')]"
+    " | //*[contains(concat(' ', normalize-space(@class), ' '), ' citation-button-wrap ')]"
+)
+
+
+def clean_reply_html(html_content: str) -> str:
+    """
+    移除回复 HTML 中的底部按钮区和引用标记，返回清理后的 HTML。
+    优先使用 lxml 原地删除节点（C 实现），未安装时回退到 BeautifulSoup。
+    """
+    if lxml is not None:
+        root = lxml.html.fromstring(html_content)
+        for node in root.xpath(_REPLY_NOISE_XPATH):
+            node.drop_tree()
+        return lxml.html.tostring(root, encoding='unicode')
+    from bs4 import BeautifulSoup  # 仅在未安装 lxml 时需要
+    soup = BeautifulSoup(html_content, 'html.parser')
+    button_area = soup.find('div', class_='seletected-text-content')
+    if button_area:
+        button_area.decompose()
+    for btn in soup.find_all('span', class_='citation-button-wrap'):
+        btn.decompose()
+    return str(soup)
+
+
+_HTML2TEXT_LOCAL = threading.local()
+
+
+def html_to_markdown(html_content: str) -> str:
+    """
+    用统一配置的 html2text 把 HTML 转为 Markdown。
+    HTML2Text 每次 handle() 都只返回本次文档的结果，可以重复使用；但实例在转换过程中保存解析状态，
+    不能在线程间共享，因此每个线程各自缓存一个实例。
+    html2text 只在 selectolax 不可用或提取失败时才需要，因此延迟导入。
+    """
+    h = getattr(_HTML2TEXT_LOCAL, "converter", None)
+    if h is None:
+        import html2text
+        h = html2text.HTML2Text()
+        h.body_width = 0
+        h.ignore_links = True
+        h.ignore_images = True
+        h.ignore_emphasis = False
+        _HTML2TEXT_LOCAL.converter = h
+    return h.handle(html_content)
+
+
+def extract_first_json(text: str) -> str:
+    """
+    从任意文本中提取第一个合法的 JSON 对象（最外层 {} 匹配），找不到时返回原文。
+    raw_decode 会正确处理字符串中的括号和转义；解析失败时直接跳到下一个 '{'，不回头重扫。
+    """
+    # 最后一个 '}' 之后的 '{' 不可能构成完整对象，直接跳过
+    i = text.find('{')
+    last_close = text.rfind('}')
+    if orjson is not None and 0 <= i < last_close:
+        # 常见情况：回复中只有一个 JSON 块，先用 orjson 校验首尾括号之间的整段
+        candidate = text[i:last_close + 1]
+        try:
+            orjson.loads(candidate)
+            return candidate
+        except orjson.JSONDecodeError:
             pass
+    while i != -1 and i < last_close:
+        try:
+            _, end = _JSON_DECODER.raw_decode(text, i)
+            return text[i:end]
+        except json.JSONDecodeError:
+            i = text.find('{', i + 1)
+    # 未找到合法 JSON，返回原文（让上层手动解析尝试）
+    return text
 
 
-atexit.register(cleanup_temp_profiles)
+@functools.lru_cache(maxsize=16)
+def _compile_indicator_filters(intermediate_indicators: tuple, thinking_completed_indicator: str):
+    """
+    编译 filter_qwen_output 使用的两个正则：
+    - 整行恰好是指示文本的块：该行连同其后直到空行（含空行）的内容
+    - 任何包含指示文本的单行
+    """
+    alternation = "|".join(map(re.escape, intermediate_indicators + (thinking_completed_indicator,)))
+    block_re = re.compile(
+        r"^[^\S\n]*(?:%s)[^\S\n]*(?:\n|\Z)(?:[^\n]*\S[^\n]*(?:\n|\Z))*(?:[^\S\n]*(?:\n|\Z))?" % alternation,
+        re.MULTILINE)
+    line_re = re.compile(r"^[^\n]*(?:%s)[^\n]*(?:\n|\Z)" % alternation, re.MULTILINE)
+    return block_re, line_re
+
 
 def filter_qwen_output(text: str, intermediate_indicators, thinking_completed_indicator) -> str:
     """过滤掉 Qwen 输出中的中间状态信息"""
     if not text:
         return text
-    lines = text.splitlines()
-    filtered_lines = []
-    skip_until_empty = False
-    for line in lines:
-        line_stripped = line.strip()
-        if line_stripped in intermediate_indicators or line_stripped == thinking_completed_indicator:
-            skip_until_empty = True
-            continue
-        if skip_until_empty and line_stripped:
-            continue
-        elif skip_until_empty and not line_stripped:
-            skip_until_empty = False
-            continue
-        is_intermediate = any(indicator in line for indicator in intermediate_indicators)
-        is_completed_indicator = thinking_completed_indicator in line
-        if is_intermediate or is_completed_indicator:
-            continue
-        filtered_lines.append(line)
-    result = "\n".join(filtered_lines)
-    return result.strip()
+    block_re, line_re = _compile_indicator_filters(tuple(intermediate_indicators), thinking_completed_indicator)
+    # 两次 C 层面的正则替换代替逐行循环：先删整行指示文本及其后的段落，再删其余含指示文本的行
+    text = block_re.sub("", text.replace("\r\n", "\n"))
+    return line_re.sub("", text).strip()
 
 
 class QwenChatClient:
     """
     一个使用 Selenium 自动化与 Qwen 网页版聊天的客户端。
+    驱动的隐式等待固定为 0，所有等待都通过显式的 WebDriverWait / _wait_for_dom_state 完成，
+    不要在此类中调用 implicitly_wait，否则会与显式等待叠加。
     """
     FIXED_TEMP_DIR_NAME = 'qwen_selenium_profile'
     PROFILE_MAX_AGE_SECONDS = 1  # 10秒
+    # 持久化用户目录：保留 HTTP 缓存、V8 代码缓存等，跨运行复用，不会被 cleanup_temp_profiles 删除
+    PERSISTENT_PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "qwen_selenium", "profile")
 
     # --- 常量定义 ---
     CHAT_INPUT_SELECTOR = "#chat-input"
@@ -79,47 +283,89 @@ class QwenChatClient:
     LOGIN_POPUP_BUTTON_XPATH = "//button[contains(text(), '保持注销状态')]"
     THINKING_COMPLETED_INDICATOR = "思考与搜索已完成"
     INTERMEDIATE_INDICATORS = ["正在思考与搜索", "tokens 预算"]
+    _INTERMEDIATE_RE = re.compile("|".join(map(re.escape, INTERMEDIATE_INDICATORS)))
+    # 功能按钮的候选定位器（按优先级排列）
+    _DEEP_THINKING_LOCATORS = (
+        (By.XPATH, DEEP_THINKING_BUTTON_XPATH),
+        (By.CSS_SELECTOR, "#chat-message-input .operationBtn button:nth-child(1)"),
+        (By.CSS_SELECTOR,
+         "#chat-message-input > div.chat-message-input-container.svelte-17xwb8y > div.chat-message-input-container-inner.svelte-17xwb8y > div.flex.items-center.min-h-\\[56px\\].mt-0\\.5.p-3.svelte-17xwb8y > div.scrollbar-none.flex.items-center.left-content.operationBtn.svelte-17xwb8y > div:nth-child(1) > button"),
+    )
+    _SEARCH_LOCATORS = (
+        (By.XPATH, SEARCH_BUTTON_XPATH),
+        (By.CSS_SELECTOR, "#chat-message-input .operationBtn button:nth-child(2)"),
+        (By.CSS_SELECTOR,
+         "#chat-message-input > div.chat-message-input-container.svelte-17xwb8y > div.chat-message-input-container-inner.svelte-17xwb8y > div.flex.items-center.min-h-\\[56px\\].mt-0\\.5.p-3.svelte-17xwb8y > div.scrollbar-none.flex.items-center.left-content.operationBtn.svelte-17xwb8y > div:nth-child(2) > button"),
+    )
     DEFAULT_MAX_WAIT_TIME = 5
     DEFAULT_GET_RESPONSE_MAX_WAIT_TIME = 300
     DEFAULT_START_MINIMIZED = False
     DEFAULT_HEADLESS = False
     INITIAL_PAGE_LOAD_TIMEOUT = 30
     SEND_MESSAGE_POST_ENTER_DELAY = 1.5
-    HANDLE_LOGIN_POPUP_QUICK_TIMEOUT = 0.1
     CLICK_FEATURE_BUTTON_TIMEOUT = 3
     CLICK_FEATURE_BUTTON_POST_CLICK_DELAY = 0.3
-    CLICK_FEATURE_BUTTON_SCROLL_DELAY = 0.1
     THINKING_PHASE_CHECK_INTERVAL = 1
-    RESPONSE_PHASE_CHECK_INTERVAL = 4.0
+    RESPONSE_PHASE_CHECK_INTERVAL = 0.5
     RESPONSE_STABILITY_THRESHOLD_SECONDS = 4.0
+    # MutationObserver 判定的静默时长：比按长度轮询判定更可靠，因此可以更短
+    RESPONSE_QUIET_PERIOD_SECONDS = 1.5
     RESPONSE_SIGNIFICANT_CHANGE_THRESHOLD = 5
     RESPONSE_FINAL_CONFIRMATION_WAIT_DURATION = 5.0
     RESPONSE_MIN_LENGTH_THRESHOLD = 50
+    DOM_STATE_POLL_FREQUENCY = 0.05
 
     # --- 常量定义结束 ---
 
     def __init__(self, headless=DEFAULT_HEADLESS, max_wait_time=DEFAULT_MAX_WAIT_TIME,
                  get_response_max_wait_time=DEFAULT_GET_RESPONSE_MAX_WAIT_TIME,
-                 driver_path=None, start_minimized=DEFAULT_START_MINIMIZED):
+                 driver_path=None, start_minimized=DEFAULT_START_MINIMIZED, persistent_profile=False):
         self.headless = headless
         self.max_wait_time = max_wait_time
         self.get_response_max_wait_time = get_response_max_wait_time
         self.driver_path = driver_path
         self.start_minimized = start_minimized
+        self.persistent_profile = persistent_profile
+        self._uses_persistent_profile = False
         self.driver = None
         self.wait = None
         self.user_data_dir = None
         self._closed = False
-        self._create_driver()
+        self._cdp_enabled = False
+        self._pool_key = (bool(headless), driver_path, bool(persistent_profile))
+        # 选择器都是常量，轮询用的脚本在这里一次性格式化好，调用时直接复用
+        self._popup_js = self._CLICK_LOGIN_POPUP_JS % json.dumps(self.LOGIN_POPUP_BUTTON_XPATH)
+        self._read_state_js = tuple(
+            self._READ_RESPONSE_STATE_JS % (
+                json.dumps(self.RESPONSE_CONTAINER_SELECTOR),
+                json.dumps(self.MAIN_CONTENT_CONTAINER_SELECTOR),
+                include_html,
+                int(self.RESPONSE_QUIET_PERIOD_SECONDS * 1000))
+            for include_html in ("false", "true"))
+        if not self._acquire_pooled_driver():
+            self._create_driver()
+        # 实例未调用 close() 就被回收（或解释器退出）时，退出浏览器并删除其临时目录
+        self._finalizer = weakref.finalize(self, _dispose_driver, self.driver, self.user_data_dir)
 
     def _setup_user_data_dir(self):
-        """为每个实例创建唯一的用户数据目录"""
-        system_temp_dir = tempfile.gettempdir()
-        unique_dir_name = f"qwen_selenium_profile_{uuid.uuid4().hex[:8]}"
-        user_data_dir_path = os.path.join(system_temp_dir, unique_dir_name)
+        """
+        为实例准备用户数据目录。
+        persistent_profile=True 且持久化目录空闲时使用 PERSISTENT_PROFILE_DIR，否则创建唯一的临时目录。
+        """
+        if self.persistent_profile and _claim_persistent_profile():
+            try:
+                os.makedirs(self.PERSISTENT_PROFILE_DIR, exist_ok=True)
+            except Exception:
+                _release_persistent_profile()
+                raise
+            self._uses_persistent_profile = True
+            self.user_data_dir = self.PERSISTENT_PROFILE_DIR
+            return self.user_data_dir
 
+        system_temp_dir = tempfile.gettempdir()
         try:
-            os.makedirs(user_data_dir_path, exist_ok=True)
+            # mkdtemp 原子地创建唯一目录，无需再生成 uuid
+            user_data_dir_path = tempfile.mkdtemp(prefix="qwen_selenium_profile_", dir=system_temp_dir)
             # print(f"[初始化] 已创建独立用户数据目录: {user_data_dir_path}")
         except Exception as e:
             # print(f"[初始化错误] 创建用户数据目录失败: {e}")
@@ -129,39 +375,109 @@ class QwenChatClient:
         return user_data_dir_path
 
 
+    def _acquire_pooled_driver(self):
+        """尝试从驱动池取出一个仍然存活的浏览器，成功返回 True。"""
+        pool = _get_driver_pool(self._pool_key)
+        while True:
+            try:
+                driver, user_data_dir = pool.get_nowait()
+            except queue.Empty:
+                return False
+            try:
+                driver.current_window_handle  # 探测会话是否仍然有效
+            except Exception:
+                _dispose_driver(driver, user_data_dir)
+                continue
+            self.driver = driver
+            self.user_data_dir = user_data_dir
+            self._uses_persistent_profile = user_data_dir == self.PERSISTENT_PROFILE_DIR
+            self.wait = WebDriverWait(self.driver, self.max_wait_time)
+            try:
+                self.driver.execute_cdp_cmd("Runtime.enable", {})
+                self._cdp_enabled = True
+            except Exception:
+                self._cdp_enabled = False
+            # print("[初始化] 复用驱动池中的 Chrome 实例")
+            return True
+
+    def _release_driver_to_pool(self):
+        """切换到新的空白标签页并关闭旧标签页后放回驱动池；池已满或浏览器异常时返回 False。"""
+        pool = _get_driver_pool(self._pool_key)
+        if pool.full():
+            return False
+        try:
+            old_handles = list(self.driver.window_handles)
+            self.driver.switch_to.new_window('tab')
+            new_handle = self.driver.current_window_handle
+            for handle in old_handles:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+            self.driver.switch_to.window(new_handle)
+            pool.put_nowait((self.driver, self.user_data_dir))
+            return True
+        except Exception:
+            return False
+
     def _create_driver(self):
         """创建并配置 WebDriver 实例。"""
         chrome_options = Options()
         if self.headless:
             chrome_options.add_argument("--headless=new")
         chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-        chrome_options.add_argument('--disable-application-cache')
-        chrome_options.add_argument('--disable-gpu-shader-disk-cache')
         chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options.add_argument('--disk-cache-size=1')  # 最小化缓存
-        chrome_options.add_argument('--media-cache-size=1')
+
+        user_data_dir_path = self._setup_user_data_dir()
+        chrome_options.add_argument(f"--user-data-dir={user_data_dir_path}")
+        if not self._uses_persistent_profile:
+            # 临时目录退出时即被删除，缓存没有复用价值，尽量少写磁盘
+            chrome_options.add_argument('--disable-application-cache')
+            chrome_options.add_argument('--disable-gpu-shader-disk-cache')
+            chrome_options.add_argument('--disk-cache-size=1')  # 最小化缓存
+            chrome_options.add_argument('--media-cache-size=1')
         chrome_options.add_argument("--disable-infobars")
         chrome_options.add_argument("--lang=zh-CN")
+        # 只读取文本回复：不加载图片，关闭与自动化无关的后台功能
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--disable-features=Translate,BackForwardCache,AcceptCHFrame,MediaRouter")
+        chrome_options.add_argument("--disable-extensions")
+        chrome_options.add_argument("--disable-background-networking")
+        chrome_options.add_argument("--disable-renderer-backgrounding")
+        chrome_options.add_argument("--disable-backgrounding-occluded-windows")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
         chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         chrome_options.add_experimental_option('useAutomationExtension', False)
-
-        user_data_dir_path = self._setup_user_data_dir()
-        chrome_options.add_argument(f"--user-data-dir={user_data_dir_path}")
+        # driver.get 在 DOMContentLoaded 后即返回，不等待图片等子资源；load_chat_page 随后显式等待输入框出现
+        chrome_options.page_load_strategy = 'eager'
 
         try:
-            if self.driver_path:
-                self.driver = webdriver.Chrome(executable_path=self.driver_path, options=chrome_options)
-            else:
-                self.driver = webdriver.Chrome(options=chrome_options)
+            # Selenium 4：通过 Service 指定驱动路径；keep_alive 复用与 ChromeDriver 的 HTTP 连接
+            service = Service(executable_path=self.driver_path) if self.driver_path else Service()
+            self.driver = webdriver.Chrome(service=service, options=chrome_options, keep_alive=True)
+            # 不使用隐式等待：所有等待都由显式 WebDriverWait 控制，find_element 未命中时立即返回
+            self.driver.implicitly_wait(0)
             self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+            try:
+                # 启用 CDP Runtime 域，轮询时直接用 Runtime.evaluate 求值
+                self.driver.execute_cdp_cmd("Runtime.enable", {})
+                self._cdp_enabled = True
+            except Exception:
+                self._cdp_enabled = False
             self.wait = WebDriverWait(self.driver, self.max_wait_time)
             # print("[初始化] 成功创建 Chrome 实例")
         except Exception as e:
             # print(f"[初始化错误] 创建 Chrome 实例失败: {e}")
+            _dispose_driver(self.driver, self.user_data_dir)
+            self.driver = None
+            self._uses_persistent_profile = False
             raise
 
-    def close(self):
-        """关闭浏览器驱动。"""
+    def close(self, discard=False):
+        """
+        关闭浏览器驱动。
+        默认把浏览器放回驱动池供下一个客户端复用；discard=True 时直接退出浏览器并回收用户目录，
+        用于出错或不再可信的会话。
+        """
         if self._closed:
             # print("[关闭] 浏览器和资源已被关闭或正在关闭。")
             return
@@ -169,10 +485,12 @@ class QwenChatClient:
         self._closed = True
         # print("[关闭] 开始关闭浏览器...")
 
+        self._finalizer.detach()
         if self.driver:
             try:
-                self.driver.quit()
-                # print("[关闭] 浏览器已关闭")
+                if discard or not self._release_driver_to_pool():
+                    _dispose_driver(self.driver, self.user_data_dir)
+                    # print("[关闭] 浏览器已关闭")
             except Exception as e:
                 # print(f"[关闭] 关闭浏览器时出错: {e}")
                 pass
@@ -182,22 +500,66 @@ class QwenChatClient:
 
         # print("[关闭] 浏览器资源已释放。")
 
-    def _handle_login_popup(self, wait_instance=None):
-        """检查并处理'保持注销状态'弹窗。"""
-        if wait_instance is None:
-            wait_instance = WebDriverWait(self.driver, self.HANDLE_LOGIN_POPUP_QUICK_TIMEOUT)
+    def _eval_js(self, expression):
+        """
+        在页面中求值一个 JS 表达式并返回其值。
+        优先走 CDP Runtime.evaluate（不需要 WebElement 参数的轮询场景），不可用时回退到 execute_script。
+        """
+        if self._cdp_enabled:
+            result = self.driver.execute_cdp_cmd(
+                "Runtime.evaluate", {"expression": expression, "returnByValue": True})
+            return result.get("result", {}).get("value")
+        return self.driver.execute_script("return " + expression + ";")
+
+    def _wait_for_dom_state(self, predicate, timeout):
+        """
+        以较高频率轮询 predicate(driver)，条件成立立即返回 predicate 的结果，超时返回 None。
+        用来替代固定时长的 time.sleep。
+        """
         try:
-            stay_logged_out_button = wait_instance.until(
-                EC.element_to_be_clickable((By.XPATH, self.LOGIN_POPUP_BUTTON_XPATH))
-            )
-            # print("[弹窗处理] 检测到登录弹窗，正在点击'保持注销状态'按钮...")
-            stay_logged_out_button.click()
-            # print("[弹窗处理] '保持注销状态'按钮已点击。")
-            time.sleep(0.1)
-            return True
+            return WebDriverWait(self.driver, timeout, poll_frequency=self.DOM_STATE_POLL_FREQUENCY,
+                                 ignored_exceptions=(StaleElementReferenceException,)).until(predicate)
         except TimeoutException:
+            return None
+
+    def _count_reply_containers(self):
+        return len(self.driver.find_elements(By.CSS_SELECTOR, self.RESPONSE_CONTAINER_SELECTOR))
+
+    def _wait_for_new_reply_container(self, previous_count):
+        """等待页面出现新的回复容器（消息已提交的信号），最多等待 SEND_MESSAGE_POST_ENTER_DELAY 秒。"""
+        return self._wait_for_dom_state(
+            lambda d: len(d.find_elements(By.CSS_SELECTOR, self.RESPONSE_CONTAINER_SELECTOR)) > previous_count,
+            self.SEND_MESSAGE_POST_ENTER_DELAY)
+
+    _CLICK_LOGIN_POPUP_JS = (
+        "(function(x){var b=document.evaluate(x,document,null,"
+        "XPathResult.FIRST_ORDERED_NODE_TYPE,null).singleNodeValue;"
+        "if(b&&b.offsetParent){b.click();return true;}return false;})(%s)"
+    )
+
+    def _click_login_popup_now(self):
+        """一次脚本调用：弹窗按钮可见则点击并返回 True，否则返回 False（无异常、无内部轮询）。"""
+        try:
+            return bool(self._eval_js(self._popup_js))
+        except Exception:
             return False
 
+    def _handle_login_popup(self, timeout=0):
+        """
+        检查并处理'保持注销状态'弹窗。
+        timeout 为 0 时只做一次即时检查；大于 0 时在该时间内等待弹窗出现（用于页面刚加载时）。
+        """
+        if timeout <= 0:
+            clicked = self._click_login_popup_now()
+        else:
+            clicked = bool(self._wait_for_dom_state(
+                lambda d: self._click_login_popup_now(), timeout))
+        if clicked:
+            # print("[弹窗处理] '保持注销状态'按钮已点击。")
+            self._wait_for_dom_state(
+                EC.invisibility_of_element_located((By.XPATH, self.LOGIN_POPUP_BUTTON_XPATH)), 0.5)
+        return clicked
+
     def load_chat_page(self, url="https://chat.qwen.ai/"):
         """导航到 Qwen 聊天页面并等待加载完成。"""
         url = url.strip()
@@ -208,7 +570,7 @@ class QwenChatClient:
             initial_wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, self.CHAT_INPUT_SELECTOR)))
             # print("[页面加载] Qwen 页面加载完成")
             # print(f"[页面加载] 页面标题: {self.driver.title}")
-            self._handle_login_popup(self.wait)
+            self._handle_login_popup(self.max_wait_time)
         except TimeoutException as e:
             error_msg = f"[页面加载错误] 等待页面元素超时: {e}"
             # print(error_msg)
@@ -219,37 +581,98 @@ class QwenChatClient:
             raise Exception(error_msg) from e
 
     # --- send_message 相关辅助方法 ---
+    # 在页面内按顺序尝试全部定位器，点击第一个可见元素，返回 [元素, 点击前的 class]
+    _CLICK_FIRST_VISIBLE_FN = (
+        "function clickFirst(sels,xps){"
+        "function hit(e){if(e&&e.offsetParent&&!e.disabled){var c=e.getAttribute('class');"
+        "e.scrollIntoView({block:'center'});e.click();return [e,c];}return null;}"
+        "for(var i=0;i<sels.length;i++){var r=hit(document.querySelector(sels[i]));if(r)return r;}"
+        "for(var j=0;j<xps.length;j++){var r=hit(document.evaluate(xps[j],document,null,"
+        "XPathResult.FIRST_ORDERED_NODE_TYPE,null).singleNodeValue);if(r)return r;}"
+        "return null;}"
+    )
+    _CLICK_FIRST_VISIBLE_JS = _CLICK_FIRST_VISIBLE_FN + "return clickFirst(arguments[0],arguments[1]);"
+    # 一次调用：先处理登录弹窗，再依次点击每组功能按钮，返回每组的点击结果
+    _CLICK_FEATURE_BUTTONS_JS = _CLICK_FIRST_VISIBLE_FN + (
+        "var p=document.evaluate(arguments[0],document,null,"
+        "XPathResult.FIRST_ORDERED_NODE_TYPE,null).singleNodeValue;"
+        "if(p&&p.offsetParent){p.click();}"
+        "return arguments[1].map(function(g){return clickFirst(g[0],g[1]);});"
+    )
+
+    def _wait_for_buttons_activated(self, click_results):
+        """按钮切换为激活状态（aria-pressed 或 class 变化）即可继续，不再固定等待。"""
+        self._wait_for_dom_state(
+            lambda d: all(element.get_attribute("aria-pressed") == "true"
+                          or element.get_attribute("class") != class_before_click
+                          for element, class_before_click in click_results),
+            self.CLICK_FEATURE_BUTTON_POST_CLICK_DELAY)
+
     def _click_feature_button(self, locators, button_name):
-        """通用方法：尝试点击功能按钮（如深度思考、搜索）"""
-        clicked = False
-        for by, locator in locators:
-            try:
-                # print(f"[发送消息] 尝试使用 {by} 定位“{button_name}”按钮: {locator}")
-                element = WebDriverWait(self.driver, self.CLICK_FEATURE_BUTTON_TIMEOUT).until(
-                    EC.element_to_be_clickable((by, locator))
-                )
-                self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", element)
-                time.sleep(self.CLICK_FEATURE_BUTTON_SCROLL_DELAY)
-                if element.is_displayed() and element.is_enabled():
-                    element.click()
-                    # print(f"[发送消息] 成功点击“{button_name}”按钮")
-                    clicked = True
-                    time.sleep(self.CLICK_FEATURE_BUTTON_POST_CLICK_DELAY)
-                    break
-                else:
-                    # print(
-                    #     f"[发送消息] “{button_name}”元素找到但不可点击 (可见: {element.is_displayed()}, 可用: {element.is_enabled()})")
-                    pass
-            except (TimeoutException, ElementClickInterceptedException) as e:
-                # print(f"[发送消息] 使用 {by} 定位“{button_name}”按钮失败 ({type(e).__name__}): {e}")
-                pass
-            except Exception as e:
-                # print(f"[发送消息] 使用 {by} 定位“{button_name}”按钮时发生未预期错误: {e}")
+        """通用方法：尝试点击功能按钮（如深度思考、搜索）。所有定位器在一次脚本调用中依次尝试。"""
+        css_selectors, xpaths = _split_locators(tuple(locators))
+        try:
+            # 按钮可能尚未渲染，整体最多等待 CLICK_FEATURE_BUTTON_TIMEOUT 秒（不再按定位器逐个超时）
+            result = self._wait_for_dom_state(
+                lambda d: d.execute_script(self._CLICK_FIRST_VISIBLE_JS, css_selectors, xpaths),
+                self.CLICK_FEATURE_BUTTON_TIMEOUT)
+        except Exception as e:
+            # print(f"[发送消息] 点击“{button_name}”按钮时发生未预期错误: {e}")
+            return False
+        if not result:
+            # print(f"[发送消息] 未找到可点击的“{button_name}”按钮")
+            return False
+        # print(f"[发送消息] 成功点击“{button_name}”按钮")
+        self._wait_for_buttons_activated([result])
+        return True
+
+    def _prepare_features(self, feature_buttons):
+        """
+        处理登录弹窗并点击需要启用的功能按钮，正常情况下只需一次脚本调用。
+        feature_buttons 为 [(locators, 按钮名称), ...]；一次调用中未找到的按钮再单独等待其渲染后点击。
+        """
+        try:
+            results = self.driver.execute_script(
+                self._CLICK_FEATURE_BUTTONS_JS, self.LOGIN_POPUP_BUTTON_XPATH,
+                [list(_split_locators(tuple(locators))) for locators, _ in feature_buttons])
+        except Exception as e:
+            # print(f"[发送消息] 批量点击功能按钮失败，逐个重试: {e}")
+            results = [None] * len(feature_buttons)
+        clicked = [result for result in results if result]
+        if clicked:
+            self._wait_for_buttons_activated(clicked)
+        for (locators, button_name), result in zip(feature_buttons, results):
+            if not result and not self._click_feature_button(locators, button_name):
+                # print(f"[发送消息] 警告：无法点击“{button_name}”按钮，将继续执行。")
                 pass
-        return clicked
+
+    # 直接写入输入框的值并派发 input 事件（兼容 textarea/input 与 contenteditable）
+    _SET_INPUT_VALUE_JS = (
+        "var e=arguments[0],t=arguments[1];"
+        "if(e.isContentEditable){e.textContent=t;"
+        "e.dispatchEvent(new InputEvent('input',{bubbles:true,inputType:'insertText',data:t}));"
+        "return e.innerText;}"
+        "var p=Object.getPrototypeOf(e),d=Object.getOwnPropertyDescriptor(p,'value');"
+        "if(d&&d.set){d.set.call(e,t);}else{e.value=t;}"
+        "e.dispatchEvent(new Event('input',{bubbles:true}));"
+        "return e.value;"
+    )
 
     def _send_keys_with_newlines_shift_enter(self, element, text):
-        """通过发送 Shift+Enter 来处理文本中的换行符。"""
+        """
+        输入包含换行符的文本。
+        优先用一次脚本调用直接写入整段文本；写入未生效时回退到逐行 send_keys + Shift+Enter。
+        """
+        try:
+            written = self.driver.execute_script(self._SET_INPUT_VALUE_JS, element, text)
+        except WebDriverException as e:
+            # print(f"[发送消息_处理换行] 脚本写入失败，回退到逐行输入: {e}")
+            written = None
+        if written is not None and written.replace('\r\n', '\n').strip() == text.strip():
+            # print("[发送消息_处理换行] 已通过脚本一次性写入多行文本")
+            return
+        # print("[发送消息_处理换行] 脚本写入未生效，回退到逐行输入")
+        element.clear()
         lines = text.split('\n')
         total_lines = len(lines)
         for i, line in enumerate(lines):
@@ -264,6 +687,8 @@ class QwenChatClient:
         """发送消息到 Qwen。"""
         try:
             message_len = len(message)
+            # 记录发送前的回复容器数量，提交后以新容器出现作为消息已发送的信号
+            reply_container_count = self._count_reply_containers()
             # print(f"[发送消息] 准备发送消息 (长度: {message_len} 字符)")
             if not enable_thinking or not enable_search:
                 status_msg = []
@@ -273,35 +698,12 @@ class QwenChatClient:
                     status_msg.append("“搜索”")
                 # print(f"[发送消息] 注意：已禁用 {', '.join(status_msg)} 功能。")
 
-            self._handle_login_popup(self.wait)
-
+            feature_buttons = []
             if enable_thinking:
-                deep_thinking_locators = [
-                    (By.XPATH, self.DEEP_THINKING_BUTTON_XPATH),
-                    (By.CSS_SELECTOR, "#chat-message-input .operationBtn button:nth-child(1)"),
-                    (By.CSS_SELECTOR,
-                     "#chat-message-input > div.chat-message-input-container.svelte-17xwb8y > div.chat-message-input-container-inner.svelte-17xwb8y > div.flex.items-center.min-h-\\[56px\\].mt-0\\.5.p-3.svelte-17xwb8y > div.scrollbar-none.flex.items-center.left-content.operationBtn.svelte-17xwb8y > div:nth-child(1) > button")
-                ]
-                if not self._click_feature_button(deep_thinking_locators, "深度思考"):
-                    # print("[发送消息] 警告：无法点击“深度思考”按钮，将继续执行。")
-                    pass
-            else:
-                # print("[发送消息] 跳过点击“深度思考”按钮。")
-                pass
-
+                feature_buttons.append((self._DEEP_THINKING_LOCATORS, "深度思考"))
             if enable_search:
-                search_locators = [
-                    (By.XPATH, self.SEARCH_BUTTON_XPATH),
-                    (By.CSS_SELECTOR, "#chat-message-input .operationBtn button:nth-child(2)"),
-                    (By.CSS_SELECTOR,
-                     "#chat-message-input > div.chat-message-input-container.svelte-17xwb8y > div.chat-message-input-container-inner.svelte-17xwb8y > div.flex.items-center.min-h-\\[56px\\].mt-0\\.5.p-3.svelte-17xwb8y > div.scrollbar-none.flex.items-center.left-content.operationBtn.svelte-17xwb8y > div:nth-child(2) > button")
-                ]
-                if not self._click_feature_button(search_locators, "搜索"):
-                    # print("[发送消息] 警告：无法点击“搜索”按钮，将继续执行。")
-                    pass
-            else:
-                # print("[发送消息] 跳过点击“搜索”按钮。")
-                pass
+                feature_buttons.append((self._SEARCH_LOCATORS, "搜索"))
+            self._prepare_features(feature_buttons)
 
             # print("[发送消息] 正在等待输入框...")
             resilient_wait = WebDriverWait(
@@ -315,7 +717,7 @@ class QwenChatClient:
             # print("[发送消息] 找到输入框")
             self.driver.execute_script("arguments[0].scrollIntoView(true);", input_box)
             input_box.click()
-            time.sleep(0.2)
+            self._wait_for_dom_state(lambda d: d.switch_to.active_element == input_box, 0.2)
 
             if '\n' in message:
                 # print("[发送消息] 检测到多行文本，使用 Shift+Enter 发送换行...")
@@ -326,8 +728,8 @@ class QwenChatClient:
 
             input_box.send_keys(Keys.ENTER)
             # print("[发送消息] 已按下 Enter 键提交消息")
-            # print("[发送消息] 等待页面状态稳定...")
-            time.sleep(self.SEND_MESSAGE_POST_ENTER_DELAY)
+            # print("[发送消息] 等待新的回复容器出现...")
+            self._wait_for_new_reply_container(reply_container_count)
             # print("[发送消息] 页面状态稳定等待结束。")
         except TimeoutException as e:
             error_msg = f"[发送消息错误] 等待输入框超时: {e}"
@@ -337,7 +739,7 @@ class QwenChatClient:
             warning_msg = f"[发送消息警告] 发送 Enter 时检测到元素过时 (StaleElementReferenceException)，消息可能已发送: {e}"
             # print(warning_msg)
             # print("[发送消息] 检测到 StaleElementReferenceException，仍将等待页面状态稳定...")
-            time.sleep(self.SEND_MESSAGE_POST_ENTER_DELAY)
+            self._wait_for_new_reply_container(reply_container_count)
             # print("[发送消息] 页面状态稳定等待结束 (Stale 后)。")
         except Exception as e:
             error_msg = f"[发送消息错误] 发送消息时出错: {e}"
@@ -347,7 +749,7 @@ class QwenChatClient:
     # --- 新增/修改的辅助方法 ---
     def _is_intermediate_state(self, text):
         """判断文本是否为中间状态"""
-        contains_thinking_start = any(indicator in text for indicator in self.INTERMEDIATE_INDICATORS)
+        contains_thinking_start = self._INTERMEDIATE_RE.search(text) is not None
         contains_thinking_end = self.THINKING_COMPLETED_INDICATOR in text
         return contains_thinking_start and not contains_thinking_end
 
@@ -385,6 +787,33 @@ class QwenChatClient:
             inner_html = None
         return reply_container, inner_html
 
+    # 在回复容器上挂一个 MutationObserver（容器被替换时重新挂载），记录最后一次变动的时间戳；
+    # 返回 [文本长度, 距最后一次变动的毫秒数, HTML]，HTML 仅在请求时或内容已静止足够久时返回
+    _READ_RESPONSE_STATE_JS = (
+        "(function(o,m,h,t){var r=document.querySelector(o);if(!r)return [-1,null,null];"
+        "if(window.__qwenObserved!==r){if(window.__qwenObserver)window.__qwenObserver.disconnect();"
+        "window.__qwenObserver=new MutationObserver(function(){window.__qwenLastMutation=Date.now();});"
+        "window.__qwenObserver.observe(r,{childList:true,subtree:true,characterData:true});"
+        "window.__qwenObserved=r;window.__qwenLastMutation=Date.now();}"
+        "var idle=Date.now()-window.__qwenLastMutation,html=null;"
+        "if(h||idle>=t){var e=r.querySelector(m);html=(e||r).innerHTML;}"
+        "return [r.textContent.length,idle,html];})(%s,%s,%s,%d)"
+    )
+
+    def _read_response_state(self, include_html=False):
+        """
+        一次往返读取回复状态，返回 (文本长度, 静止毫秒数, HTML)。
+        HTML 优先取主内容容器，不存在时取外层回复容器；include_html 为 False 且内容仍在变化时为 None。
+        容器不存在或读取失败时长度为 None。
+        """
+        try:
+            state = self._eval_js(self._read_state_js[bool(include_html)])
+        except Exception:
+            return None, None, None
+        if not state or state[0] is None or state[0] < 0:
+            return None, None, None
+        return state[0], state[1], state[2]
+
     def _extract_and_process_text(self, reply_container):
         """从 reply_container 提取文本，并处理可能的 StaleElementReferenceException。"""
         reply_container_locator = (By.CSS_SELECTOR, self.RESPONSE_CONTAINER_SELECTOR)
@@ -416,6 +845,7 @@ class QwenChatClient:
         container_wait = WebDriverWait(
             self.driver,
             self.get_response_max_wait_time,
+            poll_frequency=self.DOM_STATE_POLL_FREQUENCY,
             ignored_exceptions=(ElementClickInterceptedException,)
         )
         try:
@@ -442,23 +872,38 @@ class QwenChatClient:
         # print("[获取回复_阶段一] (已简化) 直接进入内容稳定等待阶段。")
         return reply_container, current_text
 
-    def _wait_for_content_stabilization(self, reply_container, enable_thinking=True):
+    def _partial_reply_text(self, html):
+        """把生成中的回复 HTML 转为文本，用于流式输出；转换方式与最终结果一致。"""
+        if HTMLParser is not None:
+            try:
+                return html_to_text(html)
+            except Exception:
+                pass
+        try:
+            return html_to_markdown(clean_reply_html(html))
+        except Exception:
+            return ""
+
+    def _wait_for_content_stabilization(self, reply_container, enable_thinking=True, on_partial=None):
         """
         等待回复内容稳定。
-        使用改进逻辑：连续 stable_length_count_max 次获取的 innerHTML 长度相同，
-        并且能够处理内容被截断后需要拼接的情况。
+        页面内的 MutationObserver 记录最后一次变动时间，静止超过 RESPONSE_QUIET_PERIOD_SECONDS、
+        内容达到 RESPONSE_MIN_LENGTH_THRESHOLD 且不再处于“思考中”等中间状态即视为稳定；
+        观察器不可用时退回到长度持续 RESPONSE_STABILITY_THRESHOLD_SECONDS 秒不变的判断（按 time.monotonic 计时）。
+        同时能够处理内容被截断后需要拼接的情况。
+        提供 on_partial 时每轮都取回 HTML，内容变化后以当前已生成的文本调用 on_partial。
         """
-        stable_length_count_max = 3
-        # print(
-        #     f"[获取回复_阶段二] 开始等待最终回复内容稳定 (改进逻辑: 连续{stable_length_count_max}次长度相同，支持内容拼接)...")
         check_interval = self.RESPONSE_PHASE_CHECK_INTERVAL
+        # print("[获取回复_阶段二] 开始等待最终回复内容稳定 (支持内容拼接)...")
         max_total_reply_wait_time = self.get_response_max_wait_time
         start_reply_wait_time = time.time()
 
         stable_length_count = 0
+        length_stable_since = time.monotonic()
         last_html_length = -1
         current_stable_html = None
         cached_partial_html = None
+        last_partial_html = None
         SIGNIFICANT_LENGTH_DROP_THRESHOLD = 0.5
 
         while True:
@@ -466,55 +911,60 @@ class QwenChatClient:
             if int(elapsed_reply_time) % 5 == 0 or elapsed_reply_time > max_total_reply_wait_time - 1:
                 self._handle_login_popup()
 
-            reply_container, current_html = self._extract_container_inner_html(reply_container)
-            if current_html is None:
-                # print("[获取回复_阶段二] 本轮 HTML 提取失败，重置计数器并继续等待...")
+            # 轮询阶段只取文本长度（一个整数）；内容已停顿时在同一次往返中顺带取回 HTML
+            current_html_length, idle_ms, polled_html = self._read_response_state(
+                include_html=on_partial is not None or stable_length_count >= 2)
+            if current_html_length is None:
+                # print("[获取回复_阶段二] 本轮长度探测失败，重置计数器并继续等待...")
                 stable_length_count = 0
+                length_stable_since = time.monotonic()
                 last_html_length = -1
                 time.sleep(check_interval)
                 continue
-            current_html_length = len(current_html)
 
             if (last_html_length > 0 and
                     current_html_length < last_html_length * SIGNIFICANT_LENGTH_DROP_THRESHOLD):
                 # print(
-                #     f"[获取回复_阶段二] 检测到 HTML 长度显著减少 (旧: {last_html_length}, 新: {current_html_length})。")
+                #     f"[获取回复_阶段二] 检测到内容长度显著减少 (旧: {last_html_length}, 新: {current_html_length})。")
                 if cached_partial_html is None and current_stable_html:
                     cached_partial_html = current_stable_html
                     # print(f"[获取回复_阶段二] 已缓存被截断前的内容 (长度: {len(cached_partial_html)})。")
                 stable_length_count = 0
+                length_stable_since = time.monotonic()
                 current_stable_html = None
                 # print("[获取回复_阶段二] 重置计数器和当前稳定内容，继续等待后续内容。")
             elif current_html_length == last_html_length:
                 stable_length_count += 1
                 # print(
-                #     f"[获取回复_阶段二] HTML 长度稳定计数: {stable_length_count}/{stable_length_count_max} (长度: {current_html_length})")
+                #     f"[获取回复_阶段二] 内容长度稳定计数: {stable_length_count} (长度: {current_html_length})")
             else:
                 stable_length_count = 1
+                length_stable_since = time.monotonic()
                 # print(
-                #     f"[获取回复_阶段二] HTML 长度发生变化 (旧: {last_html_length}, 新: {current_html_length})，重置计数器至 {stable_length_count}/{stable_length_count_max}")
+                #     f"[获取回复_阶段二] 内容长度发生变化 (旧: {last_html_length}, 新: {current_html_length})，重置计数器至 {stable_length_count}")
 
             last_html_length = current_html_length
-            if stable_length_count == 1:
-                current_stable_html = current_html
+            if (on_partial is not None and polled_html and polled_html != last_partial_html
+                    and not self._is_intermediate_state(polled_html)):
+                last_partial_html = polled_html
+                on_partial(self._partial_reply_text((cached_partial_html or "") + polled_html))
+            content_idle = (idle_ms is not None and polled_html is not None
+                            and idle_ms >= self.RESPONSE_QUIET_PERIOD_SECONDS * 1000
+                            and current_html_length >= self.RESPONSE_MIN_LENGTH_THRESHOLD
+                            and not self._is_intermediate_state(polled_html))
+            if (stable_length_count >= 2 or content_idle) and polled_html:
+                # 内容停顿期间留存最新的 HTML 快照，供截断拼接和超时兜底使用
+                current_stable_html = polled_html
 
-            if stable_length_count >= stable_length_count_max:
+            # 回退判断：长度持续不变足够久（计数 >= 3 保证本轮已取回 HTML）
+            length_stable = (stable_length_count >= 3 and
+                             time.monotonic() - length_stable_since >= self.RESPONSE_STABILITY_THRESHOLD_SECONDS)
+            if content_idle or length_stable:
                 # print(
-                #     f"[获取回复_阶段二] 回复 HTML 内容已稳定 (连续{stable_length_count_max}次长度为 {last_html_length})。")
+                #     f"[获取回复_阶段二] 回复内容已稳定 (长度为 {last_html_length})。")
 
-                main_content_container = None
-                try:
-                    main_content_container = reply_container.find_element(By.CSS_SELECTOR,
-                                                                          self.MAIN_CONTENT_CONTAINER_SELECTOR)
-                    # print(f"[获取回复_阶段二] 已定位到主内容容器: {self.MAIN_CONTENT_CONTAINER_SELECTOR}")
-                except Exception as e:
-                    # print(f"[获取回复_阶段二] 警告：无法定位主内容容器 {self.MAIN_CONTENT_CONTAINER_SELECTOR}: {e}")
-                    pass
-
-                current_segment_html_content = None
-                if main_content_container:
-                    _, current_segment_html_content = self._extract_container_inner_html(main_content_container)
-                else:
+                current_segment_html_content = polled_html
+                if not current_segment_html_content:
                     current_segment_html_content = current_stable_html
 
                 final_html_content = ""
@@ -529,6 +979,7 @@ class QwenChatClient:
                 if not final_html_content:
                     # print(f"[获取回复_阶段二] 警告：拼接后的最终 HTML 内容为空。继续等待内容增长...")
                     stable_length_count = 0
+                    length_stable_since = time.monotonic()
                     last_html_length = -1
                     current_stable_html = None
                     time.sleep(check_interval)
@@ -539,32 +990,22 @@ class QwenChatClient:
                     self._handle_login_popup()
 
                     if final_html_content:
+                        if HTMLParser is not None:
+                            try:
+                                return html_to_text(final_html_content)
+                            except Exception as e:
+                                # print(f"[获取回复_阶段二] selectolax 提取失败，回退到 html2text: {e}")
+                                pass
                         try:
                             # print("[获取回复_阶段二] 开始预处理 HTML 以移除不需要的元素...")
-                            soup = BeautifulSoup(final_html_content, 'html.parser')
-                            button_area = soup.find('div', class_='seletected-text-content')
-                            if button_area:
-                                button_area.decompose()
-                                # print("[预处理] 已移除底部按钮区域。")
-                            citation_buttons = soup.find_all('span', class_='citation-button-wrap')
-                            for btn in citation_buttons:
-                                btn.decompose()
-                            if citation_buttons:
-                                # print(f"[预处理] 已移除 {len(citation_buttons)} 个引用按钮/标记。")
-                                pass
-                            cleaned_html = str(soup)
+                            cleaned_html = clean_reply_html(final_html_content)
                             # print("[获取回复_阶段二] HTML 预处理完成。")
                         except Exception as e:
                             # print(f"[获取回复_阶段二] HTML 预处理失败: {e}")
                             cleaned_html = final_html_content
                         try:
                             # print("[获取回复_阶段二] 开始将预处理后的最终 HTML 转换为 Markdown...")
-                            h = html2text.HTML2Text()
-                            h.body_width = 0
-                            h.ignore_links = True
-                            h.ignore_images = True
-                            h.ignore_emphasis = False
-                            markdown_text = h.handle(cleaned_html)
+                            markdown_text = html_to_markdown(cleaned_html)
                             # print("[获取回复_阶段二] HTML 到 Markdown 转换完成。")
                             return markdown_text
                         except Exception as e:
@@ -580,27 +1021,27 @@ class QwenChatClient:
                     final_html_content = (cached_partial_html or "") + (current_stable_html or "")
                     if final_html_content.strip():
                         # print("[获取回复_阶段二] 超时但仍尝试处理已获取到的部分 HTML...")
+                        if HTMLParser is not None:
+                            try:
+                                return html_to_text(final_html_content)
+                            except Exception:
+                                pass
                         try:
-                            soup = BeautifulSoup(final_html_content, 'html.parser')
-                            h = html2text.HTML2Text()
-                            h.body_width = 0;
-                            h.ignore_links = True;
-                            h.ignore_images = True;
-                            h.ignore_emphasis = False
-                            markdown_text = h.handle(str(soup))
+                            cleaned_html = clean_reply_html(final_html_content)
+                            markdown_text = html_to_markdown(cleaned_html)
                             return markdown_text
                         except:
                             return final_html_content
                 return ""
             time.sleep(check_interval)
 
-    def get_response(self, enable_thinking=True):
-        """等待并获取 Qwen 的回复。"""
+    def get_response(self, enable_thinking=True, on_partial=None):
+        """等待并获取 Qwen 的回复。on_partial 用于接收生成过程中的文本，见 _wait_for_content_stabilization。"""
         try:
             # print(f"[获取回复] 开始等待 Qwen 回复 (深度思考已启用: {enable_thinking})...")
             reply_container = self._wait_for_reply_container()
             reply_container, _ = self._wait_for_thinking_completion(reply_container, enable_thinking)
-            final_response = self._wait_for_content_stabilization(reply_container, enable_thinking)
+            final_response = self._wait_for_content_stabilization(reply_container, enable_thinking, on_partial)
 
             if isinstance(final_response, str) and final_response:
                 # print("[获取回复] 开始后处理过滤...")
@@ -628,37 +1069,15 @@ class QwenChatClient:
             # traceback.print_exc()
             raise Exception(error_msg) from e
 
-    def chat(self, message, enable_thinking=True, enable_search=True):
+    def chat(self, message, enable_thinking=True, enable_search=True, on_partial=None):
         """发送消息并获取回复的便捷方法。"""
         self.send_message(message, enable_thinking, enable_search)
-        return self.get_response(enable_thinking=enable_thinking)
+        return self.get_response(enable_thinking=enable_thinking, on_partial=on_partial)
 
     def _extract_json_from_text(self, text: str) -> str:
-        """
-        从任意文本中提取第一个合法的 JSON 对象（最外层 {} 匹配）
-        """
-        # 使用栈匹配最外层花括号，确保提取完整 JSON
-        start = None
-        brace_count = 0
-        for i, char in enumerate(text):
-            if char == '{':
-                if brace_count == 0:
-                    start = i
-                brace_count += 1
-            elif char == '}':
-                if brace_count > 0:
-                    brace_count -= 1
-                    if brace_count == 0 and start is not None:
-                        candidate = text[start:i+1]
-                        try:
-                            # 验证是否为合法 JSON
-                            json.loads(candidate)
-                            return candidate
-                        except json.JSONDecodeError:
-                            # 不是合法 JSON，继续找下一个 {
-                            start = None
-        # 未找到合法 JSON，返回原文（让上层手动解析尝试）
-        return text
+        """从任意文本中提取第一个合法的 JSON 对象，见 extract_first_json。"""
+        return extract_first_json(text)
+
 # --- 示例用法 ---
 if __name__ == "__main__":
     client = None
@@ -1,8 +1,11 @@
 # selenium_qwen_service.py
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from qwen_chat_client import QwenChatClient
+import atexit
 import traceback
 import json
+import queue
+import threading
 
 app = Flask(__name__)
 
@@ -13,6 +16,267 @@ QWEN_GET_RESPONSE_MAX_WAIT_TIME = 1000
 QWEN_START_MINIMIZED = True
 
 
+# 预热客户端池配置：常驻的已加载页面的客户端数量，以及单个客户端处理多少次请求后回收重建
+QWEN_CLIENT_POOL_SIZE = 2
+QWEN_CLIENT_MAX_USES = 50
+# 等待空闲客户端的最长时间（秒），超时的请求返回 503，避免工作线程无限阻塞
+QWEN_CLIENT_ACQUIRE_TIMEOUT = 120
+
+
+class ClientPoolBusyError(TimeoutError):
+    """在限定时间内没有等到空闲的 Qwen 客户端。"""
+
+
+class QwenClientPool:
+    """
+    预热的 QwenChatClient 池。
+    客户端创建后即加载聊天页面，请求之间只重新导航到新对话而不重启浏览器；
+    单个客户端处理 max_uses 次请求或出错后会被关闭并在下次取用时重建。
+    """
+
+    def __init__(self, size=QWEN_CLIENT_POOL_SIZE, max_uses=QWEN_CLIENT_MAX_USES,
+                 headless=QWEN_HEADLESS, max_wait_time=QWEN_MAX_WAIT_TIME,
+                 get_response_max_wait_time=QWEN_GET_RESPONSE_MAX_WAIT_TIME,
+                 start_minimized=QWEN_START_MINIMIZED):
+        self.size = size
+        self.max_uses = max_uses
+        self.client_kwargs = dict(
+            headless=headless,
+            max_wait_time=max_wait_time,
+            get_response_max_wait_time=get_response_max_wait_time,
+            start_minimized=start_minimized
+        )
+        self._idle = queue.Queue()
+        # 令牌数即池容量，取用客户端前先拿令牌，保证同时存活的客户端不超过 size 个
+        self._slots = threading.Semaphore(size)
+        self._uses = {}
+
+    def _create_client(self):
+        print("[客户端池] 正在启动浏览器并加载页面...")
+        client = QwenChatClient(**self.client_kwargs)
+        try:
+            client.load_chat_page()
+        except Exception:
+            client.close()
+            raise
+        self._uses[id(client)] = 0
+        return client
+
+    def _discard(self, client):
+        """退出客户端的浏览器；不经过驱动池回收，出错或用满次数的浏览器不会再被复用。"""
+        self._uses.pop(id(client), None)
+        try:
+            client.close(discard=True)
+        except Exception as close_error:
+            print(f"[客户端池警告] 关闭浏览器时出错: {close_error}")
+
+    def warm_up(self):
+        """预先创建客户端直到池满；与请求并发执行时同样受 size 限制。"""
+        clients = []
+        try:
+            while len(clients) < self.size and self._slots.acquire(blocking=False):
+                try:
+                    try:
+                        clients.append(self._idle.get_nowait())
+                    except queue.Empty:
+                        clients.append(self._create_client())
+                except Exception:
+                    self._slots.release()
+                    raise
+        finally:
+            for client in clients:
+                self._idle.put(client)
+                self._slots.release()
+
+    def acquire(self, timeout=None):
+        """取出一个空闲客户端，池中没有时新建一个。"""
+        if not self._slots.acquire(timeout=timeout):
+            raise ClientPoolBusyError("等待空闲的 Qwen 客户端超时")
+        try:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                return self._create_client()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, client, failed=False):
+        """
+        归还客户端。成功的请求会把页面重置到新对话后放回池中；
+        出错或达到 max_uses 的客户端直接关闭。
+        """
+        try:
+            uses = self._uses.get(id(client), 0) + 1
+            self._uses[id(client)] = uses
+            if failed or uses >= self.max_uses:
+                self._discard(client)
+                return
+            try:
+                client.load_chat_page()
+            except Exception as reset_error:
+                print(f"[客户端池警告] 重置页面失败，丢弃该客户端: {reset_error}")
+                self._discard(client)
+                return
+            self._idle.put(client)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """关闭池中所有空闲客户端。"""
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(client)
+
+
+client_pool = QwenClientPool()
+atexit.register(client_pool.close)
+_pool_warm_up_started = threading.Event()
+
+
+def start_client_pool_warm_up():
+    """在后台线程中预热客户端池（每个进程只执行一次）。"""
+    if _pool_warm_up_started.is_set():
+        return
+    _pool_warm_up_started.set()
+
+    def _warm_up():
+        try:
+            client_pool.warm_up()
+            print("[服务] 客户端池预热完成。")
+        except Exception as warm_error:
+            print(f"[服务警告] 客户端池预热失败，将在请求时按需创建: {warm_error}")
+
+    threading.Thread(target=_warm_up, daemon=True).start()
+
+
+@app.before_request
+def _ensure_client_pool_warm_up():
+    # 由 gunicorn 等 WSGI 服务器加载时不会执行 __main__，在各工作进程收到第一个请求时开始预热
+    start_client_pool_warm_up()
+
+
+def run_qwen_chat(data, prompt, enable_thinking, enable_search, on_partial=None, on_client_ready=None):
+    """
+    发送消息并返回回复，/api/generate 与 /chat 两个接口共用这一实现。
+    使用默认浏览器参数的请求从 client_pool 取预热客户端，最多等待 QWEN_CLIENT_ACQUIRE_TIMEOUT 秒，
+    超时抛出 ClientPoolBusyError；请求里自定义了参数时按参数创建客户端，结束后总是关闭浏览器。
+    on_partial 会在生成过程中收到当前已生成的完整文本；on_client_ready 在拿到客户端、开始对话前调用。
+    """
+    client_kwargs = dict(
+        headless=data.get('headless', QWEN_HEADLESS),
+        max_wait_time=data.get('max_wait_time', QWEN_MAX_WAIT_TIME),
+        get_response_max_wait_time=data.get('get_response_max_wait_time', QWEN_GET_RESPONSE_MAX_WAIT_TIME),
+        start_minimized=data.get('start_minimized', QWEN_START_MINIMIZED)
+    )
+
+    if client_kwargs == client_pool.client_kwargs:
+        client_instance = client_pool.acquire(timeout=QWEN_CLIENT_ACQUIRE_TIMEOUT)
+        failed = True
+        try:
+            if on_client_ready:
+                on_client_ready()
+            print(f"[服务] 正在发送消息: {prompt[:50]}...")
+            reply = client_instance.chat(prompt, enable_thinking, enable_search, on_partial)
+            print(f"[服务] 成功获取回复 (长度: {len(reply)} 字符)。")
+            failed = False
+            return reply
+        finally:
+            client_pool.release(client_instance, failed=failed)
+
+    client_instance = None
+    try:
+        print("[服务] 收到请求，正在启动浏览器...")
+        client_instance = QwenChatClient(**client_kwargs)
+        print("[服务] 浏览器启动成功，正在加载页面...")
+        client_instance.load_chat_page()
+        print("[服务] 页面加载完成。")
+        if on_client_ready:
+            on_client_ready()
+
+        print(f"[服务] 正在发送消息: {prompt[:50]}...")
+        reply = client_instance.chat(prompt, enable_thinking, enable_search, on_partial)
+        print(f"[服务] 成功获取回复 (长度: {len(reply)} 字符)。")
+        return reply
+    finally:
+        # 关闭浏览器（确保资源释放）
+        if client_instance:
+            try:
+                print("[服务] 正在关闭浏览器...")
+                client_instance.close()
+                print("[服务] 浏览器已关闭。")
+            except Exception as close_error:
+                print(f"[服务警告] 关闭浏览器时出错: {close_error}")
+        else:
+            print("[服务] 未创建客户端实例，无需关闭浏览器。")
+
+
+def stream_qwen_chat(data, prompt, model, enable_thinking, enable_search):
+    """
+    以 Ollama 的 NDJSON 流式格式逐段返回回复。
+    浏览器操作在后台线程中进行，生成过程中的文本通过队列交给响应生成器；
+    每段只发送相对已发送内容新增的部分。页面重新渲染导致文本不再是已发送内容的延续时，
+    暂停发送增量，最终回复仍无法衔接时在结束消息的 full_response 字段中给出完整回复。
+    """
+    events = queue.Queue()
+
+    def _run():
+        try:
+            reply = run_qwen_chat(data, prompt, enable_thinking, enable_search,
+                                  on_partial=lambda text: events.put(("partial", text)),
+                                  on_client_ready=lambda: events.put(("ready", None)))
+            events.put(("done", reply))
+        except Exception as e:
+            print(f"[服务错误] 处理请求时发生错误: {e}")
+            print(f"[服务错误详情] {traceback.format_exc()}")
+            events.put(("error", e))
+
+    threading.Thread(target=_run, daemon=True).start()
+
+    # 拿到客户端之后才开始返回流；客户端池繁忙时直接返回 503
+    kind, payload = events.get()
+    if kind == "error" and isinstance(payload, ClientPoolBusyError):
+        return _busy_response(model)
+    if kind != "ready":
+        events.put((kind, payload))
+
+    def _chunk(**fields):
+        return json.dumps({"model": model, **fields}, ensure_ascii=False) + "\n"
+
+    def _generate():
+        sent = ""
+        while True:
+            kind, payload = events.get()
+            if kind == "partial":
+                if payload.startswith(sent) and len(payload) > len(sent):
+                    yield _chunk(response=payload[len(sent):], done=False)
+                    sent = payload
+            elif kind == "done":
+                if payload.startswith(sent):
+                    yield _chunk(response=payload[len(sent):], done=True)
+                else:
+                    print("[服务警告] 最终回复与已发送的流式内容不一致，完整回复放在 full_response 中。")
+                    yield _chunk(response="", done=True, full_response=payload)
+                return
+            else:
+                yield _chunk(error=f"Generation failed: {str(payload)}", done=True)
+                return
+
+    return Response(stream_with_context(_generate()), mimetype='application/x-ndjson')
+
+
+def _busy_response(model=None):
+    """客户端池繁忙时的 503 响应。"""
+    print("[服务警告] 等待空闲的 Qwen 客户端超时，返回 503。")
+    response_data = {"error": "All Qwen clients are busy, please retry later"}
+    if model is not None:
+        response_data["model"] = model
+    return jsonify(response_data), 503
+
+
 @app.route('/api/generate', methods=['POST'])
 def generate():
     """
@@ -24,12 +288,6 @@ def generate():
     model = data.get('model', 'qwen-web')
     stream = data.get('stream', False)
 
-    # 从你的配置中获取参数
-    headless = data.get('headless', QWEN_HEADLESS)
-    max_wait_time = data.get('max_wait_time', QWEN_MAX_WAIT_TIME)
-    get_response_max_wait_time = data.get('get_response_max_wait_time', QWEN_GET_RESPONSE_MAX_WAIT_TIME)
-    start_minimized = data.get('start_minimized', QWEN_START_MINIMIZED)
-
     # Qwen特定参数
     enable_thinking = data.get('enable_thinking', False)
     enable_search = data.get('enable_search', False)  # 默认关闭搜索以提高稳定性
@@ -37,24 +295,12 @@ def generate():
     if not prompt:
         return jsonify({"error": "No prompt provided"}), 400
 
-    client_instance = None
-    try:
-        # 2. 创建客户端实例（使用与你现有代码相同的配置）
-        print("[服务] 收到请求，正在启动浏览器...")
-        client_instance = QwenChatClient(
-            headless=headless,
-            max_wait_time=max_wait_time,
-            get_response_max_wait_time=get_response_max_wait_time,
-            start_minimized=start_minimized
-        )
-        print("[服务] 浏览器启动成功，正在加载页面...")
-        client_instance.load_chat_page()
-        print("[服务] 页面加载完成。")
+    if stream:
+        return stream_qwen_chat(data, prompt, model, enable_thinking, enable_search)
 
-        # 3. 发送消息并获取回复
-        print(f"[服务] 正在发送消息: {prompt[:50]}...")
-        reply = client_instance.chat(prompt, enable_thinking, enable_search)
-        print(f"[服务] 成功获取回复 (长度: {len(reply)} 字符)。")
+    try:
+        # 2-3. 创建客户端、发送消息并获取回复（浏览器在 run_qwen_chat 中关闭）
+        reply = run_qwen_chat(data, prompt, enable_thinking, enable_search)
 
         # 4. 构造Ollama API格式的响应
         response_data = {
@@ -65,6 +311,8 @@ def generate():
 
         status_code = 200
 
+    except ClientPoolBusyError:
+        return _busy_response(model)
     except Exception as e:
         error_details = traceback.format_exc()
         print(f"[服务错误] 处理请求时发生错误: {e}")
@@ -76,18 +324,6 @@ def generate():
         }
         status_code = 500
 
-    finally:
-        # 6. 关闭浏览器（确保资源释放）
-        if client_instance:
-            try:
-                print("[服务] 正在关闭浏览器...")
-                client_instance.close()
-                print("[服务] 浏览器已关闭。")
-            except Exception as close_error:
-                print(f"[服务警告] 关闭浏览器时出错: {close_error}")
-        else:
-            print("[服务] 未创建客户端实例，无需关闭浏览器。")
-
     # 7. 返回Ollama API格式的JSON响应
     return jsonify(response_data), status_code
 
@@ -135,34 +371,16 @@ def chat_legacy():
     enable_thinking = data.get('enable_thinking', True)
     enable_search = data.get('enable_search', False)
 
-    headless = data.get('headless', QWEN_HEADLESS)
-    max_wait_time = data.get('max_wait_time', QWEN_MAX_WAIT_TIME)
-    get_response_max_wait_time = data.get('get_response_max_wait_time', QWEN_GET_RESPONSE_MAX_WAIT_TIME)
-    start_minimized = data.get('start_minimized', QWEN_START_MINIMIZED)
-
     if not message:
         return jsonify({"error": "No message provided"}), 400
 
-    client_instance = None
     try:
-        print("[服务] 收到请求，正在启动浏览器...")
-        client_instance = QwenChatClient(
-            headless=headless,
-            max_wait_time=max_wait_time,
-            get_response_max_wait_time=get_response_max_wait_time,
-            start_minimized=start_minimized
-        )
-        print("[服务] 浏览器启动成功，正在加载页面...")
-        client_instance.load_chat_page()
-        print("[服务] 页面加载完成。")
-
-        print(f"[服务] 正在发送消息: {message[:50]}...")
-        reply = client_instance.chat(message, enable_thinking, enable_search)
-        print(f"[服务] 成功获取回复 (长度: {len(reply)} 字符)。")
-
+        reply = run_qwen_chat(data, message, enable_thinking, enable_search)
         response_data = {"reply": reply}
         status_code = 200
 
+    except ClientPoolBusyError:
+        return _busy_response()
     except Exception as e:
         error_details = traceback.format_exc()
         print(f"[服务错误] 处理请求时发生错误: {e}")
@@ -173,17 +391,6 @@ def chat_legacy():
         }
         status_code = 500
 
-    finally:
-        if client_instance:
-            try:
-                print("[服务] 正在关闭浏览器...")
-                client_instance.close()
-                print("[服务] 浏览器已关闭。")
-            except Exception as close_error:
-                print(f"[服务警告] 关闭浏览器时出错: {close_error}")
-        else:
-            print("[服务] 未创建客户端实例，无需关闭浏览器。")
-
     return jsonify(response_data), status_code
 
 
@@ -199,4 +406,10 @@ if __name__ == '__main__':
     print(f"  MAX_WAIT_TIME: {QWEN_MAX_WAIT_TIME}")
     print(f"  GET_RESPONSE_MAX_WAIT_TIME: {QWEN_GET_RESPONSE_MAX_WAIT_TIME}")
     print(f"  START_MINIMIZED: {QWEN_START_MINIMIZED}")
-    app.run(host='0.0.0.0', port=5001, debug=False)
\ No newline at end of file
+    print(f"  CLIENT_POOL_SIZE: {QWEN_CLIENT_POOL_SIZE}")
+    print(f"  CLIENT_MAX_USES: {QWEN_CLIENT_MAX_USES}")
+    print(f"  CLIENT_ACQUIRE_TIMEOUT: {QWEN_CLIENT_ACQUIRE_TIMEOUT}s")
+    start_client_pool_warm_up()
+    # 开发服务器每个请求一个线程；生产环境可使用多进程的 WSGI 服务器，每个进程各自持有客户端池，例如：
+    #   gunicorn -w 4 -k gthread --threads 2 -b 0.0.0.0:5001 selenium_qwen_service:app
+    app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
\ No newline at end of file
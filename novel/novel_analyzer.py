@@ -1,7 +1,12 @@
 import os
 import asyncio
+import concurrent.futures
+import functools
+import queue
 import re
 from tqdm.asyncio import tqdm  # ← 新增导入，用于 tqdm.write
+import requests
+from requests.adapters import HTTPAdapter
 
 from llm.qwen_chat_client import QwenChatClient
 from utils.util_chapter import get_chapter_list
@@ -16,11 +21,24 @@ PROMPTS_BASE_DIR = "../inputs/prompts/analyzer"
 REPORTS_BASE_DIR = "../reports/novels"
 
 OLLAMA_MODEL_NAME = config.DEFAULT_MODEL
+OLLAMA_REQUEST_TIMEOUT = 600
 
 QWEN_HEADLESS = True
 QWEN_MAX_WAIT_TIME = 10
 QWEN_GET_RESPONSE_MAX_WAIT_TIME = 1000
 QWEN_START_MINIMIZED = True
+# 网页版调用的线程池大小，与任务并发数一致
+QWEN_MAX_WORKERS = 16
+
+# 同一章节的多个提示词合并为一轮对话发送，每批最多的提示词数量（过大会拖慢生成、降低质量）
+PROMPT_BATCH_SIZE = 3
+# 按预计输出长度（字符数）把任务分为短/中/长三组，各组单独限制并发，长任务少占槽位
+OUTPUT_LENGTH_SAMPLE_SIZE = 20
+OUTPUT_LENGTH_BIN_THRESHOLDS = (1500, 4000)
+OUTPUT_LENGTH_BIN_MAX_CONCURRENT = {"short": 8, "medium": 5, "long": 3}
+THINK_TAG_PATTERN = re.compile(r'<think>.*?</think>', re.DOTALL)
+BLANK_LINES_PATTERN = re.compile(r'\n\s*\n')
+BATCH_RESULT_PATTERN = re.compile(r'<<<RESULT id=(\d+)>>>(.*?)<<<END>>>', re.DOTALL)
 
 
 def read_file_content(file_path, description="文件"):
@@ -36,6 +54,23 @@ def read_file_content(file_path, description="文件"):
         return None
 
 
+@functools.lru_cache(maxsize=256)
+def read_prompt_template(prompt_name: str):
+    """读取提示词模板。模板在一次运行中不会变化，按名称缓存，避免每个任务都重新读盘"""
+    return read_file_content(os.path.join(PROMPTS_BASE_DIR, f"{prompt_name}.txt"), "提示词文件")
+
+
+def write_file_content(file_path, content, description="文件"):
+    """安全地写入文件内容，成功返回 True"""
+    try:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return True
+    except Exception as e:
+        tqdm.write(f"保存{description}到 '{file_path}' 时出错: {e}")
+        return False
+
+
 def ensure_directory_exists(dir_path):
     """确保目录存在，如果不存在则创建"""
     if not os.path.exists(dir_path):
@@ -50,27 +85,86 @@ def ensure_directory_exists(dir_path):
 
 def filter_think_tags(text: str) -> str:
     """过滤掉 <think>...</think> 标签及其内容"""
-    filtered_text = re.sub(r'\<think\>.*?\<\/think\>', '', text, flags=re.DOTALL)
-    filtered_text = re.sub(r'\n\s*\n', '\n\n', filtered_text).strip()
+    filtered_text = THINK_TAG_PATTERN.sub('', text)
+    filtered_text = BLANK_LINES_PATTERN.sub('\n\n', filtered_text).strip()
     return filtered_text
 
 
+# 所有工作线程共用一个连接池，并发请求交给 Ollama 服务端统一调度批处理
+_OLLAMA_HTTP = requests.Session()
+_OLLAMA_HTTP.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32, pool_block=False))
+
+
+async def call_ollama_model(prompt: str) -> str:
+    """直接调用 Ollama /api/generate 接口（放入线程池）"""
+    def _sync_call():
+        payload = {
+            "model": OLLAMA_MODEL_NAME,
+            "prompt": prompt,
+            "stream": False,
+            "options": {"num_ctx": config.DEFAULT_NUM_CTX}
+        }
+        try:
+            response = _OLLAMA_HTTP.post(f"{config.OLLAMA_URL}/api/generate", json=payload,
+                                         timeout=OLLAMA_REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response.json().get("response", "")
+        except Exception as e:
+            error_msg = f"[Ollama 错误] 调用模型时出错: {e}"
+            tqdm.write(error_msg)
+            return error_msg
+
+    return await asyncio.to_thread(_sync_call)
+
+
+# 网页版调用使用独立的线程池，不与文件读写、HTTP 请求等共用默认线程池
+_QWEN_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=QWEN_MAX_WORKERS, thread_name_prefix="qwen")
+
+# 空闲的 Qwen 客户端，供各工作线程复用，避免每个任务都重新启动浏览器；
+# 同时工作的线程不超过 QWEN_MAX_WORKERS，空闲客户端也不会更多
+_IDLE_QWEN_CLIENTS = queue.Queue(maxsize=QWEN_MAX_WORKERS)
+
+
+def _acquire_qwen_client():
+    """取一个空闲的客户端，没有则新建。"""
+    try:
+        return _IDLE_QWEN_CLIENTS.get_nowait()
+    except queue.Empty:
+        #tqdm.write("[Qwen Web] 正在启动浏览器...")
+        return QwenChatClient(
+            headless=QWEN_HEADLESS,
+            max_wait_time=QWEN_MAX_WAIT_TIME,
+            get_response_max_wait_time=QWEN_GET_RESPONSE_MAX_WAIT_TIME,
+            start_minimized=QWEN_START_MINIMIZED
+        )
+
+
+def close_qwen_clients():
+    """关闭所有空闲的 Qwen 客户端。"""
+    while True:
+        try:
+            client = _IDLE_QWEN_CLIENTS.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            client.close()
+        except Exception as e:
+            tqdm.write(f"[Qwen Web 警告] 关闭浏览器时出错: {e}")
+
+
 async def call_qwen_web_model(prompt: str) -> str:
-    """调用网页版 Qwen 模型（放入线程池）"""
+    """调用网页版 Qwen 模型（放入线程池），浏览器会话在任务之间复用"""
     def _sync_call():
         client = None
+        reusable = False
         try:
-            #tqdm.write("[Qwen Web] 正在启动浏览器...")
-            client = QwenChatClient(
-                headless=QWEN_HEADLESS,
-                max_wait_time=QWEN_MAX_WAIT_TIME,
-                get_response_max_wait_time=QWEN_GET_RESPONSE_MAX_WAIT_TIME,
-                start_minimized=QWEN_START_MINIMIZED
-            )
+            client = _acquire_qwen_client()
+            # 每个任务都重新加载页面，从新对话开始
             client.load_chat_page()
             #tqdm.write("[Qwen Web] 浏览器启动并加载页面完成。")
             response_qwen = client.chat(prompt, True, False)
             #tqdm.write("[Qwen Web] 消息发送并接收回复完成。")
+            reusable = True
             return response_qwen
         except Exception as e:
             error_msg = f"[Qwen Web 错误] 调用模型时出错: {e}"
@@ -78,12 +172,19 @@ async def call_qwen_web_model(prompt: str) -> str:
             return error_msg
         finally:
             if client and client.driver:
-                #tqdm.write("[Qwen Web] 正在关闭浏览器...")
-                client.close()
-                #tqdm.write("[Qwen Web] 浏览器已关闭。")
+                if reusable:
+                    try:
+                        _IDLE_QWEN_CLIENTS.put_nowait(client)
+                    except queue.Full:
+                        client.close()
+                else:
+                    # 出错的会话状态不可信，直接退出浏览器（不放回驱动池），由下个任务重新创建
+                    #tqdm.write("[Qwen Web] 正在关闭浏览器...")
+                    client.close(discard=True)
+                    #tqdm.write("[Qwen Web] 浏览器已关闭。")
 
     try:
-        response = await asyncio.to_thread(_sync_call)
+        response = await asyncio.get_running_loop().run_in_executor(_QWEN_EXECUTOR, _sync_call)
         return response
     except Exception as e:
         error_msg = f"[Qwen Web 异步包装错误]: {e}"
@@ -91,9 +192,21 @@ async def call_qwen_web_model(prompt: str) -> str:
         return error_msg
 
 
+def build_full_prompt(prompt_template: str, chapter_content: str) -> str:
+    """
+    生成完整指令：提示词模板在前、章节正文在后。
+    使用同一提示词的任务共享完全相同的前缀，推理服务可以复用前缀的 KV 缓存。
+    占位符不在模板末尾时，原位置改为指向文末正文。
+    """
+    template = prompt_template.rstrip()
+    if template.endswith("[粘贴文本内容]"):
+        return template[:-len("[粘贴文本内容]")] + chapter_content
+    template = template.replace("[粘贴文本内容]", "（见文末章节正文）")
+    return f"{template}\n\n章节正文：\n{chapter_content}"
+
+
 async def analyze_chapter(novel_name: str, chapter_filename: str, prompt_name: str, model_type: str = "ollama"):
     chapter_file_path = os.path.join(NOVELS_BASE_DIR, novel_name, chapter_filename)
-    prompt_file_path = os.path.join(PROMPTS_BASE_DIR, f"{prompt_name}.txt")
     chapter_name_without_ext = os.path.splitext(chapter_filename)[0]
     report_dir_path = os.path.join(REPORTS_BASE_DIR, novel_name, chapter_name_without_ext)
     report_file_path = os.path.join(report_dir_path, f"{prompt_name}.txt")
@@ -109,20 +222,21 @@ async def analyze_chapter(novel_name: str, chapter_filename: str, prompt_name: s
     #tqdm.write(f"模型: {model_type}")
     #tqdm.write("-" * 20)
 
-    chapter_content = read_file_content(chapter_file_path, "章节文件")
+    # 文件读写放入线程池，避免阻塞事件循环中其他任务的模型调用
+    chapter_content = await asyncio.to_thread(read_file_content, chapter_file_path, "章节文件")
     if chapter_content is None:
         return False
 
-    prompt_template = read_file_content(prompt_file_path, "提示词文件")
+    prompt_template = read_prompt_template(prompt_name)
     if prompt_template is None:
         return False
 
-    full_prompt = prompt_template.replace("[粘贴文本内容]", chapter_content)
+    full_prompt = build_full_prompt(prompt_template, chapter_content)
     #tqdm.write(f"[准备] 指令已生成，总长度: {len(full_prompt)} 字符")
 
     ai_response = ""
     if model_type.lower() == "ollama":
-        pass
+        ai_response = await call_ollama_model(full_prompt)
     elif model_type.lower() == "qwen_web":
         ai_response = await call_qwen_web_model(full_prompt)
     else:
@@ -138,15 +252,126 @@ async def analyze_chapter(novel_name: str, chapter_filename: str, prompt_name: s
     if not ensure_directory_exists(report_dir_path):
         return False
 
-    try:
-        with open(report_file_path, 'w', encoding='utf-8') as f:
-            f.write(filtered_response)
-        #tqdm.write(f"[完成] 分析报告已保存至: {report_file_path}")
+    saved = await asyncio.to_thread(write_file_content, report_file_path, filtered_response, "报告")
+    #tqdm.write(f"[完成] 分析报告已保存至: {report_file_path}")
+    return saved
+
+
+def build_batch_prompt(chapter_content: str, prompt_templates: list) -> str:
+    """把同一章节的多个分析提示词合并为一条指令，章节正文只出现一次"""
+    parts = [
+        f"你需要对下面的章节完成 {len(prompt_templates)} 项相互独立的分析。"
+        f"每项分析的结果必须单独放在 <<<RESULT id=编号>>> 与 <<<END>>> 之间，编号从 1 开始，与分析编号一致。",
+        f"章节正文：\n{chapter_content}",
+    ]
+    for index, prompt_template in enumerate(prompt_templates, start=1):
+        instruction = prompt_template.replace("[粘贴文本内容]", "（见上方章节正文）")
+        parts.append(f"分析 {index}：\n{instruction}")
+    return "\n\n".join(parts)
+
+
+def split_batch_response(response: str) -> dict:
+    """解析合并回复，返回 {编号: 分析结果}"""
+    return {int(index): content.strip() for index, content in BATCH_RESULT_PATTERN.findall(response)}
+
+
+async def analyze_chapter_batch(novel_name: str, chapter_filename: str, prompt_names: list, model_type: str = "ollama"):
+    """用一轮对话完成同一章节的多个提示词分析，结果分别写入各自的报告文件"""
+    chapter_name_without_ext = os.path.splitext(chapter_filename)[0]
+    report_dir_path = os.path.join(REPORTS_BASE_DIR, novel_name, chapter_name_without_ext)
+    pending_prompt_names = [
+        name for name in prompt_names
+        if not os.path.exists(os.path.join(report_dir_path, f"{name}.txt"))
+    ]
+    if not pending_prompt_names:
         return True
-    except Exception as e:
-        tqdm.write(f"保存报告到 '{report_file_path}' 时出错: {e}")
+    if len(pending_prompt_names) == 1 or model_type.lower() != "qwen_web":
+        # 非网页模型不合并提示词；在同一任务内依次请求，保证一个任务同时只占用一个模型调用，
+        # 执行器按任务数计算的并发上限即为实际请求并发数
+        results = []
+        for name in pending_prompt_names:
+            results.append(await analyze_chapter(novel_name, chapter_filename, name, model_type))
+        return all(results)
+
+    chapter_content = await asyncio.to_thread(
+        read_file_content, os.path.join(NOVELS_BASE_DIR, novel_name, chapter_filename), "章节文件")
+    if chapter_content is None:
         return False
 
+    prompt_templates = []
+    for name in pending_prompt_names:
+        prompt_template = read_prompt_template(name)
+        if prompt_template is None:
+            return False
+        prompt_templates.append(prompt_template)
+
+    full_prompt = build_batch_prompt(chapter_content, prompt_templates)
+    ai_response = await call_qwen_web_model(full_prompt)
+
+    if not ai_response or "错误" in ai_response:
+        return False
+
+    sections = split_batch_response(filter_think_tags(ai_response))
+    if not ensure_directory_exists(report_dir_path):
+        return False
+
+    reports = []
+    for index, name in enumerate(pending_prompt_names, start=1):
+        section = sections.get(index)
+        if not section:
+            # 缺失的结果不写文件，下次运行时会重新分析
+            tqdm.write(f"[批量] 回复中缺少第 {index} 项分析结果: {novel_name}/{chapter_filename}/{name}")
+            continue
+        reports.append((os.path.join(report_dir_path, f"{name}.txt"), section))
+
+    def _write_reports():
+        return all([write_file_content(path, section, "报告") for path, section in reports])
+
+    saved = await asyncio.to_thread(_write_reports)
+    return saved and len(reports) == len(pending_prompt_names)
+
+
+def scan_existing_reports() -> set:
+    """遍历一次报告目录，返回所有已存在报告文件的路径集合"""
+    existing = set()
+    for root, _, files in os.walk(REPORTS_BASE_DIR):
+        for filename in files:
+            existing.add(os.path.join(root, filename))
+    return existing
+
+
+def estimate_prompt_output_lengths(prompt_names: list, existing_reports: set) -> dict:
+    """
+    用已有报告的平均长度估计各提示词的输出长度（字符数），每个提示词最多抽样 OUTPUT_LENGTH_SAMPLE_SIZE 份。
+    样本取自 scan_existing_reports 得到的报告路径，只对确实存在的报告读取大小。
+    没有历史报告的提示词不出现在结果中。
+    """
+    samples = {name: [] for name in prompt_names}
+    for report_path in existing_reports:
+        name, ext = os.path.splitext(os.path.basename(report_path))
+        sizes = samples.get(name)
+        if ext != ".txt" or sizes is None or len(sizes) >= OUTPUT_LENGTH_SAMPLE_SIZE:
+            continue
+        # 只统计 <报告目录>/<小说>/<章节>/<提示词>.txt 形式的章节报告
+        if len(os.path.relpath(report_path, REPORTS_BASE_DIR).split(os.sep)) != 3:
+            continue
+        try:
+            sizes.append(os.path.getsize(report_path))
+        except OSError:
+            continue
+    # 报告为 UTF-8 中文，按每字 3 字节粗略换算为字符数
+    return {name: sum(sizes) / len(sizes) / 3 for name, sizes in samples.items() if sizes}
+
+
+def output_length_bin(expected_length: float) -> str:
+    """根据预计输出长度返回所属分组"""
+    short_limit, long_limit = OUTPUT_LENGTH_BIN_THRESHOLDS
+    if expected_length < short_limit:
+        return "short"
+    if expected_length > long_limit:
+        return "long"
+    return "medium"
+
 
 async def process_top_novels_and_chapters(model_type: str = "qwen_web", top_n: int = 10, chapters_per_novel: int = 3):
     tqdm.write(f"--- 开始大规模分析任务 ---")
@@ -180,48 +405,74 @@ async def process_top_novels_and_chapters(model_type: str = "qwen_web", top_n: i
 
     tqdm.write(f"加载了 {len(prompt_names)} 个提示词: {prompt_names}")
 
-    # 在主文件中生成分析任务（包含模型和prompt逻辑）
+    # 一次遍历报告目录得到所有已存在的报告，代替逐个任务调用 os.path.exists
+    existing_reports = scan_existing_reports()
+
+    # 在主文件中生成分析任务（包含模型和prompt逻辑），网页版同一章节的提示词按 PROMPT_BATCH_SIZE 分批合并；
+    # 其他模型每个任务只含一个提示词，由执行器控制请求并发
+    batch_size = PROMPT_BATCH_SIZE if model_type.lower() == "qwen_web" else 1
     tasks_to_run = []
     for novel_name in selected_novels:
         chapter_files = selected_chapters_map[novel_name]
 
         for chapter_filename in chapter_files:
-            for prompt_name in prompt_names:
+            report_dir_path = os.path.join(REPORTS_BASE_DIR, novel_name, os.path.splitext(chapter_filename)[0])
+            pending_prompt_names = [
+                prompt_name for prompt_name in prompt_names
+                if os.path.join(report_dir_path, f"{prompt_name}.txt") not in existing_reports
+            ]
+            for start in range(0, len(pending_prompt_names), batch_size):
                 tasks_to_run.append({
                     "novel_name": novel_name,
                     "chapter_filename": chapter_filename,
-                    "prompt_name": prompt_name,
+                    "prompt_names": pending_prompt_names[start:start + batch_size],
                     "model_type": model_type
                 })
 
-    tqdm.write(f"共生成 {len(tasks_to_run)} 个分析任务。")
+    if model_type.lower() != "qwen_web":
+        # 相同提示词的任务相邻提交，提高服务端前缀缓存的命中率（稳定排序，保留小说优先级）
+        tasks_to_run.sort(key=lambda task: task["prompt_names"])
+
+    tqdm.write(f"共生成 {len(tasks_to_run)} 个分析任务（每个任务最多 {batch_size} 个提示词）。")
 
     def should_skip(task):
-        novel = task["novel_name"]
-        chapter = task["chapter_filename"]
-        prompt = task["prompt_name"]
-        report_path = os.path.join(
+        report_dir_path = os.path.join(
             REPORTS_BASE_DIR,
-            novel,
-            os.path.splitext(chapter)[0],
-            f"{prompt}.txt"
+            task["novel_name"],
+            os.path.splitext(task["chapter_filename"])[0]
+        )
+        exists = all(
+            os.path.join(report_dir_path, f"{prompt}.txt") in existing_reports
+            for prompt in task["prompt_names"]
         )
-        exists = os.path.exists(report_path)
         if exists:
             pass
-            # tqdm.write(f"[跳过] 报告已存在: {report_path}")
+            # tqdm.write(f"[跳过] 报告已存在: {report_dir_path}")
         return exists
 
+    expected_lengths = estimate_prompt_output_lengths(prompt_names, existing_reports)
+
+    def task_bin(task):
+        # 阈值针对单个提示词，合并任务按各提示词的平均预计长度分组；
+        # 所有提示词都没有历史报告时不分组（返回 None），沿用 max_concurrent 的并发上限
+        lengths = [expected_lengths[name] for name in task["prompt_names"] if name in expected_lengths]
+        if not lengths:
+            return None
+        return output_length_bin(sum(lengths) / len(lengths))
+
     async def run_single_task(task):
-        return await analyze_chapter(**task)
+        return await analyze_chapter_batch(**task)
 
     results = await run_limited_async_tasks(
         tasks=tasks_to_run,
         task_func=run_single_task,
         skip_if_exists=should_skip,
-        max_concurrent=16,
-        min_interval=6,
-        rate_limit_key="qwen_web"
+        max_concurrent=QWEN_MAX_WORKERS,
+        # 本地 Ollama 不需要网页版的请求间隔限制
+        min_interval=6 if model_type.lower() == "qwen_web" else 0,
+        rate_limit_key=model_type.lower(),
+        bin_of=task_bin,
+        bin_max_concurrent=OUTPUT_LENGTH_BIN_MAX_CONCURRENT
     )
 
     success_count = sum(results)
@@ -245,11 +496,14 @@ async def main():
 
     cleanup_task = asyncio.create_task(temp_cleanup_loop())
 
-    await process_top_novels_and_chapters(
-        model_type="qwen_web",
-        top_n=1400,
-        chapters_per_novel=100
-    )
+    try:
+        await process_top_novels_and_chapters(
+            model_type="qwen_web",
+            top_n=1400,
+            chapters_per_novel=100
+        )
+    finally:
+        await asyncio.to_thread(close_qwen_clients)
 
 
 
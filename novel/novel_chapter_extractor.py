@@ -36,16 +36,28 @@ import atexit
 import shutil
 import json
 import html
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse
-from typing import Tuple, Optional, Dict, Any, List
-
+from typing import Tuple, Optional, Dict, Any, List, Union
+
+import requests
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时只用标准库 json
+    orjson = None
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # 未安装 lxml 时只使用字符串查找
+    lxml = None
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException
 import logging
 
 # --- 新增：导入工具模块 ---
@@ -62,6 +74,7 @@ logger = logging.getLogger(__name__)
 SCRIPT_TAG_ID = "vite-plugin-ssr_pageContext"
 SCRIPT_TAG_TYPE = "application/json"
 CHAPTER_ITEM_SELECTOR = "li.chapter-item"
+CHAPTER_DATA_SELECTOR = f"script#{SCRIPT_TAG_ID}"
 CHAPTER_LOCKED_SELECTOR = "em.iconfont.chapter-locked"
 CHAPTER_LINK_SELECTOR = "a.chapter-name"
 BOOK_NAME_ID = "bookName"
@@ -69,6 +82,33 @@ CHAPTER_CONTENT_CONTAINER_SELECTOR = "div.read-content.j_readContent"
 CHAPTER_PARAGRAPH_SELECTOR = "p"
 CHAPTER_TITLE_KEY_PATH = ["pageContext", "pageProps", "pageData", "chapterInfo", "chapterName"]
 CHAPTER_CONTENT_KEY_PATH = ["pageContext", "pageProps", "pageData", "chapterInfo", "content"]
+# 页面中 JSON 数据块的精确开始标记；属性顺序不同等情况下改用 lxml 按 id 查找
+SCRIPT_START_MARKER = f'<script id="{SCRIPT_TAG_ID}" type="{SCRIPT_TAG_TYPE}">'
+# HTTP 预取得到的是原始字节，直接在字节串上查找，不必先把整页解码为 str
+SCRIPT_TAG_ID_BYTES = SCRIPT_TAG_ID.encode('utf-8')
+SCRIPT_START_MARKER_BYTES = SCRIPT_START_MARKER.encode('utf-8')
+# 按下标取字符时，str 得到单字符串、bytes 得到整数，两种类型各用一套空白集合
+JSON_WHITESPACE = {str: ' \t\r\n', bytes: frozenset(b' \t\r\n')}
+SCRIPT_XPATH = etree.XPath(f'//script[@id="{SCRIPT_TAG_ID}"]') if lxml is not None else None
+# 文件名与正文格式化使用的正则
+_RE_FILENAME_UNSAFE = re.compile(r'[\\/:*?"<>|]')
+_RE_P_JOIN = re.compile(r'</p\s*>\s*<p[^>]*>')
+_RE_P_LEAD = re.compile(r'^\s*<p[^>]*>')
+_RE_P_TAIL = re.compile(r'</p\s*>.*$')
+_RE_TAG = re.compile(r'<[^>]+>')
+_RE_BLANK = re.compile(r'\n{3,}')
+# 小说列表文件中的一行："  1. 《书名》 - URL"；对整个文件 finditer，按行首锚定并跳过 # 注释行，匹配不跨行。
+# URL 必须是起点书籍链接（含 qidian.com/book/，或以 qidian.com/book 结尾），其他链接整行视为无法识别
+_RE_NOVEL_LINE = re.compile(
+    r'^(?![^\S\n]*#)[^\n]*?《([^》\n]+)》[^\S\n]*-[^\S\n]*'
+    r'(https?://(?=\S*?qidian\.com/book(?:/|(?!\S)))\S+)', re.MULTILINE)
+# 浏览器中屏蔽的资源（图片、字体、媒体和统计脚本），只需要页面 HTML 和章节列表
+BLOCKED_URL_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.mp4", "*.mp3",
+    "*google-analytics*", "*googletagmanager*", "*doubleclick*", "*hm.baidu.com*",
+]
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
 
 # --- 新增：章节状态常量 ---
 # 注意：这些常量在主程序和 chapter_utils 中都需要保持一致。
@@ -78,14 +118,18 @@ CHAPTER_CONTENT_KEY_PATH = ["pageContext", "pageProps", "pageData", "chapterInfo
 CHAPTER_STATUS_PENDING = "pending"
 CHAPTER_STATUS_DOWNLOADED = "downloaded"
 CHAPTER_STATUS_FAILED = "failed"
+# 元数据批量写盘的间隔（秒）与累计更新次数阈值
+METADATA_FLUSH_INTERVAL = 5.0
+METADATA_FLUSH_EVERY_UPDATES = 10
 # --- 新增结束 ---
 
 
 # --- 工具函数 ---
 # sanitize_filename, get_nested_value, create_error_marker 函数保持不变
+@functools.lru_cache(maxsize=2048)
 def sanitize_filename(title: str, index: int) -> str:
     """清理章节标题以生成安全的文件名。"""
-    filename_safe_title = re.sub(r'[\\/:*?"<>|]', '_', title)
+    filename_safe_title = _RE_FILENAME_UNSAFE.sub('_', title)
     if not filename_safe_title:
         filename_safe_title = f"未命名章节_{index + 1}"
     return f"{filename_safe_title}.txt"
@@ -111,35 +155,97 @@ def create_error_marker(filepath: str, error_msg: str, error_type: str = "genera
         logger.error(f"  创建错误标记文件 '{error_filepath}' 时出错: {e}")
 
 
+def write_text_file(filepath: str, text: str):
+    """把文本一次编码为 UTF-8，通过底层文件描述符整块写入（跳过 TextIOWrapper 的分段编码与多次写调用）。"""
+    payload = memoryview(text.encode('utf-8'))
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        while payload:
+            written = os.write(fd, payload)
+            payload = payload[written:]
+    finally:
+        os.close(fd)
+
+
 # --- 核心解析函数 ---
 # extract_json_data_from_html, format_chapter_content, extract_and_format_chapter_content 函数保持不变
-def extract_json_data_from_html(html_string: str) -> Optional[Dict[str, Any]]:
-    """从HTML字符串中提取并解析JSON数据。"""
+def _loads_page_json(json_text: Union[str, bytes, memoryview]) -> Any:
+    """解析页面 JSON：优先 orjson（可直接解析 memoryview 切片）；orjson 不接受的写法（如 NaN、超大整数）再交给标准库 json。"""
+    if orjson is not None:
+        try:
+            return orjson.loads(json_text)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(json_text, memoryview):
+        json_text = json_text.tobytes()
+    return json.loads(json_text)
+
+def _find_script_text_with_lxml(html_string: Union[str, bytes]) -> Optional[str]:
+    """用 lxml 按 id 查找 JSON 数据块（标签属性顺序或写法与精确标记不一致时使用）。"""
+    tag_id = SCRIPT_TAG_ID_BYTES if isinstance(html_string, bytes) else SCRIPT_TAG_ID
+    if SCRIPT_XPATH is None or tag_id not in html_string:
+        return None
+    try:
+        nodes = SCRIPT_XPATH(lxml.html.fromstring(html_string))
+    except Exception as e:
+        logger.debug(f"  (预处理) lxml 解析页面失败: {e}")
+        return None
+    if not nodes:
+        return None
+    logger.debug("  (预处理) 通过 lxml 找到 JSON 数据块。")
+    return nodes[0].text or ""
+
+def extract_json_data_from_html(html_string: Union[str, bytes, memoryview]) -> Optional[Dict[str, Any]]:
+    """
+    从HTML中提取并解析JSON数据。
+    html_string 可以是 str（浏览器页面源码）或 UTF-8 字节（bytes / memoryview，HTTP 原始响应）；
+    传入字节时全程在字节上查找，JSON 片段以 memoryview 零拷贝切出后直接交给 orjson 解析。
+    """
     try:
         logger.debug("  (预处理) 正在查找 JSON 数据块...")
-        start_marker = f'<script id="{SCRIPT_TAG_ID}" type="{SCRIPT_TAG_TYPE}">'
-        end_marker = '</script>'
+        if isinstance(html_string, memoryview):
+            html_string = html_string.tobytes()  # 只取视图覆盖的字节（.obj 是整个底层缓冲区）
+        if isinstance(html_string, bytes):
+            start_marker = SCRIPT_START_MARKER_BYTES
+            end_marker = b'</script>'
+        else:
+            start_marker = SCRIPT_START_MARKER
+            end_marker = '</script>'
 
+        # str.find 在 C 层扫描，比完整解析 HTML 快得多，作为首选路径
         start_index = html_string.find(start_marker)
         if start_index == -1:
-            logger.warning(f"  (预处理) 未找到开始标记 '{start_marker}'")
-            return None
-
-        json_start_index = start_index + len(start_marker)
-        end_index = html_string.find(end_marker, json_start_index)
-        if end_index == -1:
-            logger.warning(f"  (预处理) 找到开始标记但未找到结束标记 '{end_marker}'")
-            return None
+            json_text = _find_script_text_with_lxml(html_string)
+            if json_text is None:
+                logger.warning(f"  (预处理) 未找到开始标记 '{SCRIPT_START_MARKER}'")
+                return None
+        else:
+            json_start_index = start_index + len(start_marker)
+            end_index = html_string.find(end_marker, json_start_index)
+            if end_index == -1:
+                logger.warning("  (预处理) 找到开始标记但未找到结束标记 '</script>'")
+                return None
+            # 跳过首尾空白后只切一次；字节串经 memoryview 切片不复制数据
+            whitespace = JSON_WHITESPACE[type(html_string)]
+            while json_start_index < end_index and html_string[json_start_index] in whitespace:
+                json_start_index += 1
+            while end_index > json_start_index and html_string[end_index - 1] in whitespace:
+                end_index -= 1
+            if isinstance(html_string, bytes):
+                json_text = memoryview(html_string)[json_start_index:end_index]
+            else:
+                json_text = html_string[json_start_index:end_index]
 
-        json_text = html_string[json_start_index:end_index].strip()
+        if isinstance(json_text, str):
+            json_text = json_text.strip()
         if not json_text:
             logger.warning("  (预处理) 提取到的 JSON 文本块为空。")
             return None
 
-        logger.debug(f"  (预处理) 成功提取 JSON 文本块，长度约 {len(json_text)} 字符。")
+        logger.debug(f"  (预处理) 成功提取 JSON 文本块，长度约 {len(json_text)}。")
         logger.debug("  (预处理) 正在尝试解析提取到的 JSON...")
 
-        data = json.loads(json_text)
+        data = _loads_page_json(json_text)
         logger.info("  (预处理) JSON 解析成功。")
         return data
 
@@ -154,15 +260,21 @@ def extract_json_data_from_html(html_string: str) -> Optional[Dict[str, Any]]:
 def format_chapter_content(raw_content: str) -> str:
     """格式化章节内容，处理段落分隔。"""
     try:
-        decoded_content = html.unescape(raw_content)
-        formatted_content = re.sub(r'</p\s*>\s*<p[^>]*>', '', decoded_content)
-        formatted_content = re.sub(r'^\s*<p[^>]*>', '', formatted_content)
-        formatted_content = re.sub(r'</p\s*>.*$', '', formatted_content)
-        formatted_content = re.sub(r'<[^>]+>', '\n\n', formatted_content)
-        formatted_content = re.sub(r'\n{3,}', '\n\n', formatted_content)
+        # 起点正文通常只有 <p> 开始标签，各步骤先用子串检查跳过不可能匹配的整段扫描与复制
+        formatted_content = html.unescape(raw_content)
+        if '</p' in formatted_content:
+            formatted_content = _RE_P_JOIN.sub('', formatted_content)
+        formatted_content = _RE_P_LEAD.sub('', formatted_content)
+        if '</p' in formatted_content:
+            formatted_content = _RE_P_TAIL.sub('', formatted_content)
+        formatted_content = _RE_TAG.sub('\n\n', formatted_content)
+        if '\n\n\n' in formatted_content:
+            formatted_content = _RE_BLANK.sub('\n\n', formatted_content)
         formatted_content = formatted_content.strip()
         # 确保 Windows 风格换行符
-        formatted_content = formatted_content.replace('\r\n', '\n').replace('\n', '\r\n')
+        if '\r' in formatted_content:
+            formatted_content = formatted_content.replace('\r\n', '\n')
+        formatted_content = formatted_content.replace('\n', '\r\n')
         logger.info("内容格式化完成。")
         return formatted_content
     except Exception as e:
@@ -205,6 +317,41 @@ def extract_and_format_chapter_content(json_data: Dict[str, Any]) -> Tuple[str,
     return "", ""
 
 
+def create_chrome_driver(headless: bool, user_data_dir: str) -> webdriver.Chrome:
+    """按提取器的统一配置启动一个 Chrome（反自动化检测、屏蔽图片等资源、开启性能日志）。"""
+    chrome_options = Options()
+    if headless:
+        chrome_options.add_argument("--headless=new")
+    else:
+        chrome_options.add_argument("--window-size=1024,768")
+
+    chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+    chrome_options.add_argument("--disable-infobars")
+    chrome_options.add_argument("--lang=zh-CN")
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    # chrome_options.add_argument("--disable-images")
+    chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+
+    chrome_options.add_argument(f"--user-data-dir={user_data_dir}")
+
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+    # 打开性能日志以拿到 Network.responseReceived 事件，用于按 requestId 读取章节页原始响应
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    driver = webdriver.Chrome(options=chrome_options)
+    logger.info("ChromeDriver 启动成功。")
+    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    except Exception as e:
+        logger.warning(f"设置资源屏蔽失败，将加载完整页面: {e}")
+    return driver
+
+
 # --- 主类 ---
 # NovelChapterExtractor 类保持不变
 class NovelChapterExtractor:
@@ -213,11 +360,13 @@ class NovelChapterExtractor:
     # --- 新增：类变量用于存储全局临时目录路径 ---
     _global_temp_dir: Optional[str] = None
     _cleanup_registered = False  # 标记是否已注册清理函数
+    _temp_dir_lock = threading.Lock()  # 多本小说并行时保证全局目录只创建一次
     # --- 新增结束 ---
 
     def __init__(self, novel_url: str, save_base_dir: str = "novel", max_free_chapters: int = 100,
                  headless: bool = False, max_wait_time: int = 30, chapter_delay: float = 0.5,
-                 fixed_wait_time: float = 2.0):
+                 fixed_wait_time: float = 2.0, use_http_fetch: bool = True, http_concurrency: int = 4,
+                 driver: Optional[webdriver.Chrome] = None):
         # 注意：移除了 global_temp_dir 参数
         self.novel_url = novel_url.strip()
         self.save_base_dir = save_base_dir
@@ -226,17 +375,38 @@ class NovelChapterExtractor:
         self.max_wait_time = max_wait_time
         self.chapter_delay = chapter_delay
         self.fixed_wait_time = fixed_wait_time
+        # 章节页的 JSON 数据由服务端渲染，可直接用 HTTP 请求获取；失败时回退到浏览器
+        self.use_http_fetch = use_http_fetch
+        self.http_concurrency = http_concurrency
+        self.http_session: Optional[requests.Session] = None
         # self.global_temp_dir = global_temp_dir # 移除此实例变量
 
-        self.driver: Optional[webdriver.Chrome] = None
+        # 传入 driver（通常来自 BrowserPool）时复用该浏览器，run() 结束后不关闭它
+        self.driver: Optional[webdriver.Chrome] = driver
+        self._owns_driver = driver is None
         self.wait: Optional[WebDriverWait] = None
         self.novel_id = self._extract_novel_id(self.novel_url)
         self.bookname = "未知小说"
         self.novel_save_dir: Optional[str] = None
+        # (保存目录, 标题, 序号) -> 章节 TXT 路径，同一章节在检查、写入、出错时会多次用到
+        self._path_cache: Dict[Tuple[str, str, int], str] = {}
+        # 本次运行中成功写入的 TXT 文件名，run() 结束时统一清理它们的旧错误标记文件
+        self._downloaded_this_run: set = set()
+        # 保存目录中已有的文件名，进入目录时扫描一次，代替每章一次 os.path.exists
+        self._existing_files: Optional[set] = None
 
         # --- 新增：元数据相关属性 ---
         self.metadata_file_path: Optional[str] = None
         self.metadata: Dict[str, Any] = {}
+        # 状态更新只标记为脏，按时间或次数批量写盘，run() 结束时一定写一次
+        self._metadata_dirty = False
+        self._pending_status_updates = 0
+        self._last_metadata_flush = time.monotonic()
+        # 标题 -> 章节记录（同名时指向第一条），与 metadata["chapters"] 共享同一批字典
+        self._chapter_index: Dict[str, Dict[str, Any]] = {}
+        # 元数据写盘线程与快照队列（容量 1，只保留最新一份未写出的快照）
+        self._metadata_queue: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue(maxsize=1)
+        self._metadata_writer: Optional[threading.Thread] = None
         # --- 新增结束 ---
 
     def _extract_novel_id(self, base_url: str) -> Optional[str]:
@@ -249,72 +419,61 @@ class NovelChapterExtractor:
                 return path_parts[book_index + 1]
         return None
 
+    @classmethod
+    def ensure_global_temp_dir(cls) -> Optional[str]:
+        """返回全局临时用户数据目录，首次调用时创建并注册退出清理；创建失败返回 None。"""
+        with cls._temp_dir_lock:
+            if not NovelChapterExtractor._global_temp_dir:
+                try:
+                    # 如果类变量为空，说明是首次调用，需要创建
+                    NovelChapterExtractor._global_temp_dir = tempfile.mkdtemp(prefix='qidian_global_')
+                    logger.info(f"创建全局临时用户数据目录: {NovelChapterExtractor._global_temp_dir}")
+
+                    # 定义清理函数
+                    def _cleanup_global_temp_dir():
+                        temp_dir = NovelChapterExtractor._global_temp_dir
+                        if temp_dir and os.path.exists(temp_dir):
+                            try:
+                                shutil.rmtree(temp_dir)
+                                logger.info(f"全局临时用户数据目录已清理: {temp_dir}")
+                            except Exception as e:
+                                logger.warning(f"清理全局临时目录 '{temp_dir}' 时出错: {e}")
+                        elif temp_dir:
+                            logger.debug(f"全局临时目录不存在或已被删除: {temp_dir}")
+
+                    # 注册清理函数（只注册一次）
+                    if not NovelChapterExtractor._cleanup_registered:
+                        atexit.register(_cleanup_global_temp_dir)
+                        NovelChapterExtractor._cleanup_registered = True
+                        logger.debug("全局临时目录清理函数已注册。")
+
+                except Exception as e:
+                    logger.error(f"创建全局临时用户数据目录失败: {e}")
+                    return None
+            return cls._global_temp_dir
+
     def setup_driver(self) -> bool:
         """设置并启动Selenium WebDriver，优先使用类变量中的全局临时目录。"""
         if not self.novel_id:
             logger.error("小说URL无效，无法提取小说ID。")
             return False
 
-        # --- 修改点：检查并创建全局临时目录 ---
-        if not NovelChapterExtractor._global_temp_dir:
-            try:
-                # 如果类变量为空，说明是首次调用，需要创建
-                NovelChapterExtractor._global_temp_dir = tempfile.mkdtemp(prefix='qidian_global_')
-                logger.info(f"创建全局临时用户数据目录: {NovelChapterExtractor._global_temp_dir}")
-
-                # 定义清理函数
-                def _cleanup_global_temp_dir():
-                    temp_dir = NovelChapterExtractor._global_temp_dir
-                    if temp_dir and os.path.exists(temp_dir):
-                        try:
-                            shutil.rmtree(temp_dir)
-                            logger.info(f"全局临时用户数据目录已清理: {temp_dir}")
-                        except Exception as e:
-                            logger.warning(f"清理全局临时目录 '{temp_dir}' 时出错: {e}")
-                    elif temp_dir:
-                        logger.debug(f"全局临时目录不存在或已被删除: {temp_dir}")
-
-                # 注册清理函数（只注册一次）
-                if not NovelChapterExtractor._cleanup_registered:
-                    atexit.register(_cleanup_global_temp_dir)
-                    NovelChapterExtractor._cleanup_registered = True
-                    logger.debug("全局临时目录清理函数已注册。")
+        # 由 BrowserPool 注入的浏览器直接使用，不再启动新的 Chrome
+        if self.driver is not None:
+            self.wait = WebDriverWait(self.driver, self.max_wait_time)
+            return True
 
-            except Exception as e:
-                logger.error(f"创建全局临时用户数据目录失败: {e}")
-                return False
+        # --- 修改点：检查并创建全局临时目录 ---
+        if not NovelChapterExtractor.ensure_global_temp_dir():
+            return False
 
         # 使用类变量中的全局临时目录
         temp_user_data_dir_to_use = NovelChapterExtractor._global_temp_dir
         logger.info(f"为所有小说使用全局临时用户数据目录: {temp_user_data_dir_to_use}")
         # --- 修改点结束 ---
 
-        chrome_options = Options()
-        if self.headless:
-            chrome_options.add_argument("--headless=new")
-        else:
-            chrome_options.add_argument("--window-size=1024,768")
-
-        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-        chrome_options.add_argument("--disable-infobars")
-        chrome_options.add_argument("--lang=zh-CN")
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        # chrome_options.add_argument("--disable-images")
-
-        # --- 修改点：使用确定的全局临时目录 ---
-        chrome_options.add_argument(f"--user-data-dir={temp_user_data_dir_to_use}")
-        # --- 修改点结束 ---
-
-        chrome_options.add_argument(
-            "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36")
-
         try:
-            self.driver = webdriver.Chrome(options=chrome_options)
-            logger.info("ChromeDriver 启动成功。")
-            self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+            self.driver = create_chrome_driver(self.headless, temp_user_data_dir_to_use)
             self.wait = WebDriverWait(self.driver, self.max_wait_time)
 
             # --- 修改点：移除实例内的 atexit 注册 ---
@@ -335,6 +494,7 @@ class NovelChapterExtractor:
         try:
             with open(self.metadata_file_path, 'r', encoding='utf-8') as f:
                 self.metadata = json.load(f)
+            self._rebuild_chapter_index()
             logger.info(f"已加载元数据文件: {self.metadata_file_path}")
             return True
         except json.JSONDecodeError as e:
@@ -344,18 +504,75 @@ class NovelChapterExtractor:
         return False
 
     def _save_metadata(self):
-        """将当前元数据保存到文件。"""
+        """
+        将当前元数据保存到文件。
+        主线程只把元数据序列化为快照（同时保证快照内容一致），写盘交给后台线程；
+        后台线程来不及写时，新快照直接替换队列中尚未写出的旧快照。
+        """
         if not self.metadata_file_path or not self.metadata:
             logger.debug("没有元数据需要保存或路径未设置。")
             return
         try:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(self.metadata_file_path), exist_ok=True)
-            with open(self.metadata_file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.metadata, f, ensure_ascii=False, indent=4)
-            logger.debug(f"元数据已保存至: {self.metadata_file_path}")
+            snapshot = json.dumps(self.metadata, ensure_ascii=False, indent=4)
         except Exception as e:
-            logger.error(f"保存元数据文件 '{self.metadata_file_path}' 时出错: {e}")
+            logger.error(f"序列化元数据时出错: {e}")
+            return
+        if self._metadata_writer is None:
+            self._metadata_writer = threading.Thread(target=self._metadata_writer_loop, daemon=True)
+            self._metadata_writer.start()
+        try:
+            self._metadata_queue.put_nowait((self.metadata_file_path, snapshot))
+        except queue.Full:
+            try:
+                self._metadata_queue.get_nowait()  # 丢弃还没写出的旧快照
+            except queue.Empty:
+                pass
+            self._metadata_queue.put_nowait((self.metadata_file_path, snapshot))
+        self._metadata_dirty = False
+        self._pending_status_updates = 0
+        self._last_metadata_flush = time.monotonic()
+
+    def _metadata_writer_loop(self):
+        """后台写盘线程：依次写出队列中的元数据快照，收到 None 时退出。"""
+        while True:
+            item = self._metadata_queue.get()
+            if item is None:
+                return
+            file_path, snapshot = item
+            try:
+                # 确保目录存在
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                # 先写临时文件再原子替换，中途崩溃也不会留下半截的元数据文件
+                tmp_path = f"{file_path}.tmp"
+                write_text_file(tmp_path, snapshot)
+                os.replace(tmp_path, file_path)
+                logger.debug(f"元数据已保存至: {file_path}")
+            except Exception as e:
+                logger.error(f"保存元数据文件 '{file_path}' 时出错: {e}")
+
+    def _close_metadata_writer(self, timeout: float = 30.0):
+        """等待后台线程写完最后一份快照后退出。"""
+        if self._metadata_writer is None:
+            return
+        self._metadata_queue.put(None)  # 队列容量为 1，会等到最后一份快照被取走
+        self._metadata_writer.join(timeout)
+        if self._metadata_writer.is_alive():
+            logger.warning("等待元数据写盘超时。")
+        self._metadata_writer = None
+
+    def _maybe_flush_metadata(self):
+        """元数据有未保存的更新，且距上次写盘超过间隔或累计更新达到阈值时写盘。"""
+        if not self._metadata_dirty:
+            return
+        if (self._pending_status_updates >= METADATA_FLUSH_EVERY_UPDATES or
+                time.monotonic() - self._last_metadata_flush >= METADATA_FLUSH_INTERVAL):
+            self._save_metadata()
+
+    def _rebuild_chapter_index(self):
+        """根据 metadata["chapters"] 重建按标题查找的索引。"""
+        self._chapter_index = {}
+        for chapter in self.metadata.get("chapters", []):
+            self._chapter_index.setdefault(chapter["title"], chapter)
 
     def _initialize_metadata(self, bookname: str, titles: List[str], links: List[str]):
         """初始化元数据结构。"""
@@ -365,19 +582,22 @@ class NovelChapterExtractor:
             "save_dir": self.novel_save_dir,
             "chapters": []
         }
+        self._chapter_index = {}
         for title, link in zip(titles, links):
             # 如果是从已有的元数据加载的，则保留原有状态，否则初始化为 pending
-            existing_chapter = next((c for c in self.metadata.get("chapters", []) if c["title"] == title), None)
+            existing_chapter = self._chapter_index.get(title)
             if existing_chapter:
                 # 如果已有记录，则保留其状态和链接（以防链接变化）
                 # 注意：这里假设标题是唯一的，实际情况可能需要更健壮的匹配（如链接）
                 self.metadata["chapters"].append(existing_chapter)
             else:
-                self.metadata["chapters"].append({
+                chapter = {
                     "title": title,
                     "link": link,
                     "status": CHAPTER_STATUS_PENDING # 使用主程序定义的常量
-                })
+                }
+                self.metadata["chapters"].append(chapter)
+                self._chapter_index[title] = chapter
         self._save_metadata() # 初始化后立即保存
 
     def _update_chapter_status(self, title: str, status: str):
@@ -385,16 +605,73 @@ class NovelChapterExtractor:
         if "chapters" not in self.metadata:
             logger.warning("元数据中没有章节列表，无法更新状态。")
             return
-        for chapter in self.metadata["chapters"]:
-            if chapter["title"] == title:
-                old_status = chapter.get("status", "unknown")
-                chapter["status"] = status
-                logger.debug(f"章节 '{title}' 状态从 '{old_status}' 更新为 '{status}'")
-                self._save_metadata() # 每次状态更新后保存
-                return
+        chapter = self._chapter_index.get(title)
+        if chapter is not None:
+            old_status = chapter.get("status", "unknown")
+            chapter["status"] = status
+            logger.debug(f"章节 '{title}' 状态从 '{old_status}' 更新为 '{status}'")
+            self._metadata_dirty = True
+            self._pending_status_updates += 1
+            self._maybe_flush_metadata()
+            return
         logger.warning(f"在元数据中未找到章节 '{title}' 以更新状态。")
     # --- 新增结束 ---
 
+    # 一次脚本调用读取整个目录：每项为 [标题, 链接, 是否锁定]
+    _COLLECT_CHAPTERS_JS = (
+        "return Array.from(document.querySelectorAll(arguments[0])).map(function(li){"
+        "var a=li.querySelector(arguments[2]);"
+        "return [a?a.innerText.trim():'',a?a.href:'',!!li.querySelector(arguments[1])];});"
+    )
+
+    def _collect_free_chapters(self) -> Tuple[List[str], List[str]]:
+        """读取目录中的免费章节（最多 max_free_chapters 个），返回 (标题列表, 链接列表)。"""
+        try:
+            items = self.driver.execute_script(
+                self._COLLECT_CHAPTERS_JS, CHAPTER_ITEM_SELECTOR, CHAPTER_LOCKED_SELECTOR, CHAPTER_LINK_SELECTOR)
+        except Exception as e:
+            logger.warning(f"  脚本读取章节列表失败，改为逐个元素读取: {e}")
+            return self._collect_free_chapters_by_elements()
+
+        all_titles, all_links = [], []
+        for title, link, locked in items:
+            if len(all_titles) >= self.max_free_chapters:
+                break
+            if locked:
+                continue
+            if title and link:
+                all_titles.append(title)
+                all_links.append(link)
+                logger.debug(f"  [免费] {title}")
+        return all_titles, all_links
+
+    def _collect_free_chapters_by_elements(self) -> Tuple[List[str], List[str]]:
+        """逐个元素读取免费章节（脚本读取失败时的回退路径）。"""
+        chapter_items = self.driver.find_elements(By.CSS_SELECTOR, CHAPTER_ITEM_SELECTOR)
+        free_count = 0
+        all_titles, all_links = [], []
+        for item in chapter_items:
+            if free_count >= self.max_free_chapters:
+                break
+            try:
+                item.find_element(By.CSS_SELECTOR, CHAPTER_LOCKED_SELECTOR)
+                continue
+            except:
+                pass
+
+            try:
+                link_element = item.find_element(By.CSS_SELECTOR, CHAPTER_LINK_SELECTOR)
+                title = link_element.text.strip()
+                relative_link = link_element.get_attribute("href")
+                if title and relative_link:
+                    all_titles.append(title)
+                    all_links.append(relative_link)
+                    free_count += 1
+                    logger.debug(f"  [免费] {title}")
+            except Exception as e:
+                logger.warning(f"  提取章节信息时出错: {e}")
+        return all_titles, all_links
+
     def get_novel_info_and_free_chapters(self) -> Tuple[str, list, list]:
         """获取小说名称和免费章节列表，并处理元数据。"""
         if not self.driver or not self.wait:
@@ -412,13 +689,11 @@ class NovelChapterExtractor:
             logger.debug("driver.get 执行完成，小说主页请求已发送，开始等待页面加载...")
 
             logger.debug(f"等待 '{CHAPTER_ITEM_SELECTOR}' 元素出现...")
-            try:
-                self.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, CHAPTER_ITEM_SELECTOR)))
+            # 目录由服务端渲染，第一个章节项出现时列表已完整，无需再额外等待
+            if self._wait_for_selector(CHAPTER_ITEM_SELECTOR, self.max_wait_time):
                 logger.debug(f"检测到 '{CHAPTER_ITEM_SELECTOR}' 元素。")
-            except TimeoutException:
+            else:
                 logger.warning(f"等待 '{CHAPTER_ITEM_SELECTOR}' 超时。")
-
-            time.sleep(1)
             logger.debug("主页加载等待阶段结束。")
 
         except Exception as e:
@@ -442,10 +717,11 @@ class NovelChapterExtractor:
             self.bookname = f"未知小说_{self.novel_id}"
 
         try:
-            safe_bookname = re.sub(r'[\\/:*?"<>|]', '_', self.bookname)
+            safe_bookname = _RE_FILENAME_UNSAFE.sub('_', self.bookname)
             self.novel_save_dir = os.path.join(self.save_base_dir, safe_bookname)
             os.makedirs(self.novel_save_dir, exist_ok=True)
             logger.info(f"章节文件将保存在目录: {self.novel_save_dir}")
+            self._scan_existing_files()
 
             # --- 新增：设置元数据文件路径 ---
             self.metadata_file_path = os.path.join(self.novel_save_dir, "novel_metadata.json")
@@ -460,36 +736,14 @@ class NovelChapterExtractor:
         # --- 新增结束 ---
 
         try:
-            chapter_items = self.driver.find_elements(By.CSS_SELECTOR, CHAPTER_ITEM_SELECTOR)
-            free_count = 0
-            all_titles, all_links = [], []
-            for item in chapter_items:
-                if free_count >= self.max_free_chapters:
-                    break
-                try:
-                    item.find_element(By.CSS_SELECTOR, CHAPTER_LOCKED_SELECTOR)
-                    continue
-                except:
-                    pass
-
-                try:
-                    link_element = item.find_element(By.CSS_SELECTOR, CHAPTER_LINK_SELECTOR)
-                    title = link_element.text.strip()
-                    relative_link = link_element.get_attribute("href")
-                    if title and relative_link:
-                        all_titles.append(title)
-                        all_links.append(relative_link)
-                        free_count += 1
-                        logger.debug(f"  [免费] {title}")
-                except Exception as e:
-                    logger.warning(f"  提取章节信息时出错: {e}")
+            all_titles, all_links = self._collect_free_chapters()
 
             # --- 新增：根据元数据过滤需要处理的章节 ---
             if metadata_loaded and self.metadata.get("chapters"):
                 logger.info("根据现有元数据过滤章节...")
                 for title, link in zip(all_titles, all_links):
                     # 查找元数据中对应的章节
-                    meta_chapter = next((c for c in self.metadata["chapters"] if c["title"] == title), None)
+                    meta_chapter = self._chapter_index.get(title)
                     if meta_chapter:
                         # 如果状态是 pending 或 failed，则加入待处理列表
                         if meta_chapter.get("status") in [CHAPTER_STATUS_PENDING, CHAPTER_STATUS_FAILED]: # 使用常量
@@ -533,13 +787,30 @@ class NovelChapterExtractor:
         """获取章节 TXT 文件的完整路径。"""
         if not self.novel_save_dir:
             raise ValueError("保存目录未设置。")
-        filename = sanitize_filename(title, index)
-        return os.path.join(self.novel_save_dir, filename)
+        key = (self.novel_save_dir, title, index)
+        txt_filepath = self._path_cache.get(key)
+        if txt_filepath is None:
+            txt_filepath = os.path.join(self.novel_save_dir, sanitize_filename(title, index))
+            self._path_cache[key] = txt_filepath
+        return txt_filepath
+
+    def _scan_existing_files(self):
+        """扫描一次保存目录，记录已有的文件名；扫描失败时退回逐个 os.path.exists 检查。"""
+        try:
+            with os.scandir(self.novel_save_dir) as entries:
+                self._existing_files = {entry.name for entry in entries}
+        except OSError as e:
+            logger.warning(f"扫描目录 '{self.novel_save_dir}' 失败，将逐个检查文件: {e}")
+            self._existing_files = None
 
     def _check_txt_file_exists(self, title: str, index: int) -> Tuple[bool, str]:
-        """检查章节 TXT 文件是否已存在。"""
+        """检查章节 TXT 文件是否已存在（优先使用开始时扫描得到的文件名集合）。"""
         txt_filepath = self._get_txt_filepath(title, index)
-        if os.path.exists(txt_filepath):
+        if self._existing_files is not None:
+            is_exist = sanitize_filename(title, index) in self._existing_files
+        else:
+            is_exist = os.path.exists(txt_filepath)
+        if is_exist:
             logger.info(f"  章节 '{title}' 的TXT文件已存在，跳过下载和解析。")
             # --- 新增：如果文件存在，更新元数据状态 ---
             self._update_chapter_status(title, CHAPTER_STATUS_DOWNLOADED) # 使用常量
@@ -547,34 +818,124 @@ class NovelChapterExtractor:
             return True, txt_filepath
         return False, txt_filepath
 
+    _WAIT_FOR_SELECTOR_JS = """
+        const [selector, timeoutMs, done] = arguments;
+        if (document.querySelector(selector)) { done(true); return; }
+        const observer = new MutationObserver(() => {
+            if (document.querySelector(selector)) { observer.disconnect(); clearTimeout(timer); done(true); }
+        });
+        const timer = setTimeout(() => { observer.disconnect(); done(false); }, timeoutMs);
+        observer.observe(document.documentElement, {childList: true, subtree: true});
+    """
+
+    def _wait_for_selector(self, selector: str, timeout: float) -> bool:
+        """
+        在页面内用 MutationObserver 等待元素出现，元素一出现立即返回 True，超时返回 False。
+        只需一次 WebDriver 往返，不像 WebDriverWait 那样每 500ms 轮询一次 find_element。
+        """
+        try:
+            self.driver.set_script_timeout(timeout + 5)
+            return bool(self.driver.execute_async_script(self._WAIT_FOR_SELECTOR_JS, selector, int(timeout * 1000)))
+        except Exception as e:
+            logger.debug(f"  等待元素 '{selector}' 时出错: {e}")
+            return False
+
     def _navigate_and_wait(self, full_url: str, title: str) -> bool:
-        """导航到章节页面并等待固定时间。"""
+        """导航到章节页面并等待章节数据出现。"""
         try:
+            self._drain_performance_log()
             logger.debug(f"  准备执行 driver.get('{full_url}') ...")
             self.driver.get(full_url)
             logger.debug(f"  driver.get 执行完成，'{title}' 页面请求已发送。")
 
-            logger.debug(f"  开始固定等待 {self.fixed_wait_time} 秒...")
-            time.sleep(self.fixed_wait_time)
-            logger.debug(f"  章节 '{title}' 固定等待结束。")
+            # JSON 数据块一出现就结束等待，fixed_wait_time 作为等待上限
+            logger.debug(f"  等待章节数据出现（最多 {self.fixed_wait_time} 秒）...")
+            if not self._wait_for_selector(CHAPTER_DATA_SELECTOR, self.fixed_wait_time):
+                logger.debug(f"  章节 '{title}' 在 {self.fixed_wait_time} 秒内未检测到数据块，继续尝试解析。")
             return True
         except Exception as e:
             logger.error(f"  访问章节 '{title}' 页面时发生错误: {e}")
             return False
 
-    def _process_chapter_content(self, title: str, index: int, total: int) -> bool:
-        """处理单个章节的内容（获取、解析、保存）。"""
+    def _drain_performance_log(self) -> list:
+        """取出并清空浏览器性能日志，读取失败时返回空列表。"""
+        try:
+            return self.driver.get_log("performance")
+        except Exception as e:
+            logger.debug(f"  读取性能日志失败: {e}")
+            return []
+
+    def _get_page_html_via_cdp(self) -> Optional[str]:
+        """
+        通过 CDP Network.getResponseBody 读取当前章节页的原始响应 HTML。
+        服务端返回的 HTML 已包含 JSON 数据块，省去 page_source 对整个 DOM 的重新序列化；
+        找不到主文档响应或读取失败时返回 None，由调用方回退到 page_source。
+        """
+        request_id = None
+        for entry in self._drain_performance_log():
+            message = entry.get("message", "")
+            if "Network.responseReceived" not in message:
+                continue
+            try:
+                event = json.loads(message)["message"]
+            except (ValueError, KeyError):
+                continue
+            params = event.get("params", {})
+            if event.get("method") == "Network.responseReceived" and params.get("type") == "Document":
+                request_id = params.get("requestId")  # 以最后一个主文档响应为准（跳转后的最终页面）
+        if not request_id:
+            return None
+        try:
+            body = self.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+        except Exception as e:
+            logger.debug(f"  CDP 读取响应体失败: {e}")
+            return None
+        if body.get("base64Encoded"):
+            return None
+        page_html = body.get("body", "")
+        return page_html if SCRIPT_TAG_ID in page_html else None
+
+    def _setup_http_session(self):
+        """创建 HTTP 会话，并带上浏览器访问小说主页后得到的 Cookie。"""
+        session = requests.Session()
+        session.headers.update({"User-Agent": USER_AGENT, "Accept-Language": "zh-CN,zh;q=0.9"})
+        try:
+            for cookie in self.driver.get_cookies():
+                session.cookies.set(cookie["name"], cookie["value"],
+                                    domain=cookie.get("domain"), path=cookie.get("path", "/"))
+        except Exception as e:
+            logger.warning(f"复制浏览器 Cookie 失败，HTTP 请求将不带 Cookie: {e}")
+        self.http_session = session
+
+    def _fetch_html_http(self, full_url: str) -> Optional[bytes]:
+        """用 HTTP 请求获取章节页面源码（UTF-8 原始字节），失败或页面中没有 JSON 数据块时返回 None。"""
+        try:
+            response = self.http_session.get(full_url, timeout=self.max_wait_time)
+            if response.status_code != 200:
+                logger.debug(f"  HTTP 获取 '{full_url}' 返回状态码 {response.status_code}")
+                return None
+            page_html = response.content
+        except Exception as e:
+            logger.debug(f"  HTTP 获取 '{full_url}' 失败: {e}")
+            return None
+        return page_html if SCRIPT_TAG_ID_BYTES in page_html else None
+
+    def _process_chapter_content(self, title: str, index: int, total: int,
+                                 page_html: Optional[Union[str, bytes]] = None, page_url: Optional[str] = None) -> bool:
+        """处理单个章节的内容（获取、解析、保存）。未提供 page_html 时读取浏览器当前页面的源码。"""
         is_exist, txt_filepath = self._check_txt_file_exists(title, index)
         if is_exist:
             return True # 已存在，处理成功
 
         try:
-            page_html = self.driver.page_source
+            if page_html is None:
+                page_html = self._get_page_html_via_cdp() or self.driver.page_source
+                page_url = self.driver.current_url
             logger.debug(f"  已获取 '{title}' 的页面源码，准备解析...")
 
             json_data = extract_json_data_from_html(page_html)
             if not json_data:
-                error_msg = f"[解析失败] 无法从HTML中提取JSON数据\nURL: {self.driver.current_url}\n"
+                error_msg = f"[解析失败] 无法从HTML中提取JSON数据\nURL: {page_url}\n"
                 create_error_marker(txt_filepath, error_msg, "json_extract")
                 # --- 新增：更新元数据状态为失败 ---
                 self._update_chapter_status(title, CHAPTER_STATUS_FAILED) # 使用常量
@@ -585,24 +946,17 @@ class NovelChapterExtractor:
             if final_title and formatted_content:
                 save_title = final_title if final_title else title
                 try:
-                    with open(txt_filepath, 'w', encoding='utf-8') as f:
-                        f.write(save_title + "\n\n")
-                        f.write(formatted_content)
+                    write_text_file(txt_filepath, save_title + "\n\n" + formatted_content)
                     logger.info(f"  章节 '{save_title}' 内容已解析并保存至: {txt_filepath}")
 
                     # --- 新增：更新元数据状态为已下载 ---
                     self._update_chapter_status(title, CHAPTER_STATUS_DOWNLOADED) # 使用常量
                     # --- 新增结束 ---
 
-                    # 清理可能存在的旧错误文件
-                    for suffix in [".error", ".error_general", ".error_json_extract", ".error_write"]:
-                        old_error_file = txt_filepath + suffix
-                        if os.path.exists(old_error_file):
-                            try:
-                                os.remove(old_error_file)
-                                logger.debug(f"  已删除旧的错误文件: {old_error_file}")
-                            except OSError as e:
-                                logger.warning(f"  删除旧错误文件 '{old_error_file}' 时出错: {e}")
+                    # 旧的错误文件在 run() 结束时一次扫描目录统一清理
+                    self._downloaded_this_run.add(os.path.basename(txt_filepath))
+                    if self._existing_files is not None:
+                        self._existing_files.add(os.path.basename(txt_filepath))
                     return True
                 except Exception as e:
                     error_msg = f"[写入失败] 保存文件时出错: {e}\n"
@@ -630,21 +984,49 @@ class NovelChapterExtractor:
             # --- 新增结束 ---
             return False
 
-    def download_and_parse_chapter(self, title: str, relative_link: str, index: int, total: int) -> bool:
-        """下载并解析单个章节。"""
+    def _remove_stale_error_markers(self):
+        """扫描一次保存目录，删除本次成功下载章节的旧错误标记文件（*.error*）。"""
+        if not self._downloaded_this_run or not self.novel_save_dir:
+            return
+        try:
+            with os.scandir(self.novel_save_dir) as entries:
+                for entry in entries:
+                    if ".error" not in entry.name:
+                        continue
+                    if entry.name.rsplit(".error", 1)[0] not in self._downloaded_this_run:
+                        continue
+                    try:
+                        os.remove(entry.path)
+                        logger.debug(f"  已删除旧的错误文件: {entry.path}")
+                    except OSError as e:
+                        logger.warning(f"  删除旧错误文件 '{entry.path}' 时出错: {e}")
+        except OSError as e:
+            logger.warning(f"扫描目录 '{self.novel_save_dir}' 清理错误文件时出错: {e}")
+
+    @staticmethod
+    def _chapter_url(relative_link: str) -> str:
+        """把章节链接补全为绝对 URL。"""
         # 修复 urljoin 的基础 URL
-        full_url = relative_link if relative_link.startswith('http') else urljoin("https://www.qidian.com/", relative_link)
+        return relative_link if relative_link.startswith('http') else urljoin("https://www.qidian.com/", relative_link)
+
+    def download_and_parse_chapter(self, title: str, relative_link: str, index: int, total: int,
+                                   prefetched_html: Optional[bytes] = None) -> bool:
+        """下载并解析单个章节。提供 prefetched_html（HTTP 预取的页面源码）时不再用浏览器打开章节页。"""
+        full_url = self._chapter_url(relative_link)
         logger.info(f"[{index + 1}/{total}] 正在处理章节: {title} ({full_url})")
 
         # --- 新增：在开始处理前，先检查元数据状态（可能在其他地方已更新）---
         # 这是一个额外的安全检查，虽然主循环已经筛选过了
         if "chapters" in self.metadata:
-            meta_chapter = next((c for c in self.metadata["chapters"] if c["title"] == title), None)
+            meta_chapter = self._chapter_index.get(title)
             if meta_chapter and meta_chapter.get("status") == CHAPTER_STATUS_DOWNLOADED: # 使用常量
                  logger.info(f"  检查元数据发现章节 '{title}' 已标记为已下载，跳过。")
                  return True # 假设文件也存在
         # --- 新增结束 ---
 
+        if prefetched_html is not None:
+            return self._process_chapter_content(title, index, total, prefetched_html, full_url)
+
         if not self._navigate_and_wait(full_url, title):
             txt_filepath = self._get_txt_filepath(title, index)
             error_msg = f"错误: 无法访问章节页面 {full_url}\n"
@@ -656,21 +1038,6 @@ class NovelChapterExtractor:
 
         return self._process_chapter_content(title, index, total)
 
-    def _generate_txt_filename(self, title, index):
-        """
-        根据章节标题生成预期的 TXT 文件名。
-        与 _check_and_get_txt_filepath 中生成文件名的逻辑保持一致。
-        :param title: 章节标题
-        :param index: 章节索引 (主要用于备用命名，实际可能用不到)
-        :return: str, 预期的文件名 (不包含路径)
-        """
-        # 清理标题中的非法字符
-        filename_safe_title = re.sub(r'[\\/:*?"<>|]', '_', title)
-        # 确保文件名不为空
-        if not filename_safe_title:
-            filename_safe_title = f"未命名章节_{index + 1}"
-        return f"{filename_safe_title}.txt"
-
     def run(self):
         """
         执行完整的提取流程，优化：预先筛选出需要下载的章节。
@@ -691,16 +1058,27 @@ class NovelChapterExtractor:
             success_count = 0
             total_chapters_to_process = len(titles)
 
+            # HTTP 并发预取所有章节页；解析、保存和元数据更新仍在主线程中按顺序进行
+            if self.use_http_fetch:
+                self._setup_http_session()
+                with ThreadPoolExecutor(max_workers=self.http_concurrency) as executor:
+                    prefetched_pages = list(executor.map(
+                        lambda link: self._fetch_html_http(self._chapter_url(link)), links))
+                logger.info(f"HTTP 预取成功 {sum(page is not None for page in prefetched_pages)}/{len(links)} 个章节页面，"
+                            f"其余章节使用浏览器获取。")
+            else:
+                prefetched_pages = [None] * total_chapters_to_process
+
             for i, (title, link) in enumerate(zip(titles, links)):
                 logger.info(
                     f"[{i + 1}/{total_chapters_to_process}] 计划下载章节: {title}")
 
                 # 调用下载解析方法，传递原始索引和总章节数用于内部可能的日志或计算
-                if self.download_and_parse_chapter(title, link, i, total_chapters_to_process):
+                if self.download_and_parse_chapter(title, link, i, total_chapters_to_process, prefetched_pages[i]):
                     success_count += 1
 
-                # 章节间延迟
-                if i < total_chapters_to_process - 1:
+                # 章节间延迟（只有用浏览器打开章节页时需要）
+                if prefetched_pages[i] is None and i < total_chapters_to_process - 1:
                     logger.debug(f"  章节间延迟 {self.chapter_delay} 秒...")
                     time.sleep(self.chapter_delay)
             # --- 修改结束 ---
@@ -713,7 +1091,9 @@ class NovelChapterExtractor:
         except Exception as e:
             logger.exception(f"执行过程中发生未预期的错误: {e}")
         finally:
-            if self.driver:
+            if self.http_session:
+                self.http_session.close()
+            if self.driver and self._owns_driver:
                 try:
                     self.driver.quit()
                     logger.info("浏览器已关闭。")
@@ -722,7 +1102,84 @@ class NovelChapterExtractor:
             # --- 新增：确保最后保存一次元数据 ---
             if self.metadata and self.metadata_file_path:
                 self._save_metadata()
+            self._close_metadata_writer()
             # --- 新增结束 ---
+            self._remove_stale_error_markers()
+
+
+class BrowserPool:
+    """
+    预先启动的 Chrome 池，供多本小说并行提取时复用，避免每本小说都重启浏览器。
+    Chrome 不能多个实例共用一个用户数据目录，因此每个浏览器在全局临时目录下各用一个子目录。
+    归还时会检查浏览器是否仍可用，已崩溃或会话失效的浏览器被替换为新启动的实例。
+    """
+
+    def __init__(self, size: int = 2, headless: bool = True):
+        self.size = size
+        self.headless = headless
+        # 池中放 None 表示该位置的浏览器无法重启，取到的调用方应放弃本次任务
+        self._idle: "queue.Queue[Optional[webdriver.Chrome]]" = queue.Queue()
+        self._drivers: Dict[int, Tuple[webdriver.Chrome, str]] = {}  # id(driver) -> (driver, 用户数据子目录)
+        self._lock = threading.Lock()
+
+    def _start_driver(self) -> Optional[webdriver.Chrome]:
+        """在独立的用户数据子目录中启动一个浏览器，失败返回 None。"""
+        base_dir = NovelChapterExtractor.ensure_global_temp_dir()
+        if not base_dir:
+            return None
+        user_data_dir = tempfile.mkdtemp(prefix='browser_', dir=base_dir)
+        try:
+            driver = create_chrome_driver(self.headless, user_data_dir)
+        except Exception as e:
+            logger.error(f"浏览器池启动 ChromeDriver 失败: {e}")
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+            return None
+        with self._lock:
+            self._drivers[id(driver)] = (driver, user_data_dir)
+        return driver
+
+    def _dispose(self, driver: webdriver.Chrome):
+        """退出浏览器并删除其用户数据子目录。"""
+        with self._lock:
+            _, user_data_dir = self._drivers.pop(id(driver), (driver, None))
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.debug(f"退出浏览器时出错: {e}")
+        if user_data_dir:
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+
+    def warm_up(self) -> int:
+        """启动浏览器直到池满，返回成功启动的数量。"""
+        while len(self._drivers) < self.size:
+            driver = self._start_driver()
+            if driver is None:
+                break
+            self._idle.put(driver)
+        return len(self._drivers)
+
+    def acquire(self) -> Optional[webdriver.Chrome]:
+        """取出一个空闲浏览器，全部占用时阻塞等待；返回 None 表示池中的浏览器已无法重启。"""
+        return self._idle.get()
+
+    def release(self, driver: Optional[webdriver.Chrome]):
+        """归还浏览器；浏览器已崩溃或会话失效时退出它，并在新的子目录中启动一个替换实例。"""
+        if driver is not None:
+            try:
+                driver.current_url  # 探测会话是否仍然有效
+            except Exception as e:
+                logger.warning(f"浏览器会话已失效，正在重启: {e}")
+                self._dispose(driver)
+                driver = self._start_driver()
+        self._idle.put(driver)
+
+    def close(self):
+        """关闭池中所有浏览器。"""
+        with self._lock:
+            drivers = [driver for driver, _ in self._drivers.values()]
+        for driver in drivers:
+            self._dispose(driver)
+        logger.info("浏览器池已关闭。")
 
 
 # --- 文件加载函数 ---
@@ -773,26 +1230,29 @@ def load_urls_from_file(filepath: str) -> List[Tuple[str, str]]:
     返回 [(书名, URL), ...] 的列表。
     """
     novels = []
-    novel_pattern = re.compile(r'.*?《([^》]+)》\s*-\s*(https?://[^\s]+)')
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
+            text = f.read()
+
+        # 整个文件一次 finditer；行号只在匹配处从上一个匹配位置往后累计换行数得到
+        matched_lines = set()
+        line_num, line_start = 1, 0
+        for match in _RE_NOVEL_LINE.finditer(text):
+            line_num += text.count('\n', line_start, match.start())
+            line_start = match.start()
+            matched_lines.add(line_num)
+
+            bookname = match.group(1).strip()
+            url = match.group(2).rstrip('/') + '/'
+            novels.append((bookname, url))
+            logging.debug(f"  从第 {line_num} 行提取到: 书名='{bookname}', URL='{url}'")
+
+        # 无法识别的行只在需要输出警告时才逐行找出
+        if logging.getLogger().isEnabledFor(logging.WARNING):
+            for line_num, line in enumerate(text.split('\n'), 1):
                 line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-
-                match = novel_pattern.search(line)
-                if match:
-                    bookname = match.group(1).strip()
-                    url = match.group(2).rstrip('/') + '/'
-                    if "qidian.com/book/" in url:
-                         novels.append((bookname, url))
-                         logging.debug(f"  从第 {line_num} 行提取到: 书名='{bookname}', URL='{url}'")
-                    else:
-                         logging.warning(f"  跳过第 {line_num} 行：找到URL但不像是起点书籍链接: {url}")
-                else:
-                    if line and not line.startswith('#'):
-                        logging.warning(f"  跳过第 {line_num} 行：无法识别格式或未找到书名和URL: '{line}'")
+                if line and not line.startswith('#') and line_num not in matched_lines:
+                    logging.warning(f"  跳过第 {line_num} 行：无法识别格式或未找到书名和URL: '{line}'")
 
         logging.info(f"从文件 '{filepath}' 成功加载 {len(novels)} 个小说信息。")
     except FileNotFoundError:
@@ -813,6 +1273,7 @@ def main():
     MAX_WAIT_TIME = 30
     CHAPTER_DELAY = 1.0
     FIXED_WAIT_TIME = 2.0
+    BROWSER_POOL_SIZE = 2  # 同时处理的小说数（每本占用一个浏览器）
     # --- 配置区域结束 ---
 
     # 1. 读取 (书名, URL) 列表
@@ -825,7 +1286,8 @@ def main():
     total_novels = len(novel_info_list)
     successful_novels = 0
 
-    # 3. 遍历 (书名, URL) 对
+    # 3. 遍历 (书名, URL) 对，先做预检查，需要处理的小说再交给浏览器池并行提取
+    pending_novels = []
     for index, (bookname, novel_url) in enumerate(novel_info_list):
         # 4. 日志使用书名
         logger.info(f"=== 开始检查第 {index + 1}/{total_novels} 本小说: {bookname} ===")
@@ -843,9 +1305,26 @@ def main():
             continue
 
         logger.info(f"=== 需要处理第 {index + 1}/{total_novels} 本小说《{bookname}》 ===")
+        pending_novels.append((index, bookname, novel_url))
+
+    if not pending_novels:
+        logger.info(f"所有小说处理完毕。总共 {total_novels} 本，成功处理（包括跳过） {successful_novels} 本。")
+        return
 
+    browser_pool = BrowserPool(size=min(BROWSER_POOL_SIZE, len(pending_novels)), headless=HEADLESS_MODE)
+    browser_count = browser_pool.warm_up()
+    if not browser_count:
+        logger.error("浏览器池中没有可用的浏览器，程序退出。")
+        return
+
+    def process_novel(index: int, bookname: str, novel_url: str) -> bool:
+        driver = browser_pool.acquire()
+        if driver is None:
+            browser_pool.release(None)
+            logger.error(f"=== 第 {index + 1}/{total_novels} 本小说 '{bookname}' 没有可用的浏览器，跳过 ===\n")
+            return False
         try:
-            # 6. 创建提取器实例 (使用解析出的 URL)
+            # 6. 创建提取器实例 (使用解析出的 URL)，复用池中的浏览器
             extractor = NovelChapterExtractor(
                 novel_url=novel_url,
                 save_base_dir=SAVE_BASE_DIR,
@@ -853,14 +1332,25 @@ def main():
                 headless=HEADLESS_MODE,
                 max_wait_time=MAX_WAIT_TIME,
                 chapter_delay=CHAPTER_DELAY,
-                fixed_wait_time=FIXED_WAIT_TIME
+                fixed_wait_time=FIXED_WAIT_TIME,
+                driver=driver
             )
             extractor.run()
-            successful_novels += 1
             logger.info(f"=== 第 {index + 1}/{total_novels} 本小说处理完成 ===\n")
+            return True
         except Exception as e:
             # 7. 日志包含书名和URL
             logger.error(f"=== 处理第 {index + 1}/{total_novels} 本小说 '{bookname}' (URL: {novel_url}) 时发生严重错误: {e} ===\n")
+            return False
+        finally:
+            browser_pool.release(driver)
+
+    try:
+        with ThreadPoolExecutor(max_workers=browser_count) as executor:
+            results = list(executor.map(lambda novel: process_novel(*novel), pending_novels))
+        successful_novels += sum(results)
+    finally:
+        browser_pool.close()
 
     logger.info(f"所有小说处理完毕。总共 {total_novels} 本，成功处理（包括跳过） {successful_novels} 本。")
 
@@ -331,6 +331,49 @@ class LLMGraphRequest(BaseModel):
     prompt: str = Field(description="用户的扩展提示词")
     context_graph: Optional[Dict[str, Any]] = Field(default=None, description="上下文图谱信息（可选）")
 
+
+@dataclass
+class ContextSummary:
+    """上下文图谱摘要：由调用方预先计算，传给 LLM 提示词使用。"""
+    node_count: int = 0
+    relationship_count: int = 0
+    neighbor_labels: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_graph(cls, context_graph: Dict[str, Any], node_id: Optional[str] = None,
+                   top_k: int = 10, max_label_length: int = 20) -> 'ContextSummary':
+        """从上下文图谱计算摘要，可附带当前节点的前 top_k 个相邻节点标签"""
+        nodes = context_graph.get('nodes', [])
+        relationships = context_graph.get('relationships', [])
+        neighbor_labels = []
+        if node_id and top_k > 0:
+            labels = {n.get('id'): n.get('label', n.get('id', '')) for n in nodes}
+            seen = set()
+            for rel in relationships:
+                source_id, target_id = rel.get('source_id'), rel.get('target_id')
+                if source_id == node_id:
+                    neighbor_id = target_id
+                elif target_id == node_id:
+                    neighbor_id = source_id
+                else:
+                    continue
+                if not neighbor_id or neighbor_id in seen:
+                    continue
+                seen.add(neighbor_id)
+                neighbor_labels.append(str(labels.get(neighbor_id, neighbor_id))[:max_label_length])
+                if len(neighbor_labels) >= top_k:
+                    break
+        return cls(node_count=len(nodes), relationship_count=len(relationships),
+                   neighbor_labels=neighbor_labels)
+
+    def to_prompt(self) -> str:
+        """转换为提示词中的上下文信息段落"""
+        text = f"上下文图谱信息：节点数: {self.node_count}, 关系数: {self.relationship_count}"
+        if self.neighbor_labels:
+            text += f"\n相邻节点: {', '.join(self.neighbor_labels)}"
+        return text
+
+
 class LLMGraphNode(BaseModel):
     """LLM生成的图节点"""
     id: str = Field(description="节点ID")
@@ -1,7 +1,15 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import re
-import math
+
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+_HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
+_WORD_RE = re.compile(r'\S+')
+
+# 动态上下文长度的上限，也是未指定 context_length 时保留的上下文 token 数
+MAX_CONTEXT_LENGTH = 32768
 
 
 class OllamaClient:
@@ -12,6 +20,11 @@ class OllamaClient:
         self.remove_think_tags = remove_think_tags
         self.context = []  # 对话上下文
         self.default_context_length = context_length  # 默认上下文窗口大小
+        # 复用连接池，保持 HTTP keep-alive，避免每次调用都重新建立连接
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
 
     def generate(self, prompt, **kwargs):
         """
@@ -22,11 +35,77 @@ class OllamaClient:
             prompt: 输入提示
             **kwargs: 可选参数（options, system, max_tokens等）
         """
+        data = self._build_request_data(prompt, stream=False, **kwargs)
+
+        try:
+            response = self._session.post(f"{self.base_url}/api/generate",
+                                          json=data)
+            response.raise_for_status()
+        except Exception as e:
+            error_msg = e.response.text if hasattr(e, 'response') and e.response else str(e)
+            raise Exception(f"Ollama请求失败: {error_msg}")
+
+        # 处理响应
+        try:
+            result = response.json()
+            response_text = result.get('response', '')
+            # 更新上下文
+            self._update_context(result.get('context', []))
+
+            # 移除<think>标签（如果启用）
+            if self.remove_think_tags:
+                response_text = _HTML_COMMENT_RE.sub('', response_text)  # 移除HTML注释
+                response_text = _THINK_RE.sub('', response_text)
+                response_text = _BLANK_LINES_RE.sub('\n\n', response_text).strip()
+
+            return response_text
+        except json.JSONDecodeError as e:
+            raise Exception(f"JSON解析失败: {str(e)}")
+
+    def generate_stream(self, prompt, **kwargs):
+        """
+        流式生成文本响应，边接收边产出已清理的文本片段，参数同 generate。
+        启用 remove_think_tags 时按 generate 的同样规则清理（注释、<think> 块、空行、首尾空白），
+        拼接所有片段即得到 generate 的返回值；块内文本与末尾空白会暂存到能确定如何处理时再输出。
+        """
+        data = self._build_request_data(prompt, stream=True, **kwargs)
+
+        try:
+            response = self._session.post(f"{self.base_url}/api/generate",
+                                          json=data, stream=True)
+            response.raise_for_status()
+        except Exception as e:
+            error_msg = e.response.text if hasattr(e, 'response') and e.response else str(e)
+            raise Exception(f"Ollama请求失败: {error_msg}")
+
+        cleaner = _StreamingResponseCleaner() if self.remove_think_tags else None
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise Exception(f"JSON解析失败: {str(e)}")
+
+                text = chunk.get('response', '')
+                if chunk.get('done'):
+                    # 最后一条消息携带上下文
+                    self._update_context(chunk.get('context', []))
+                if cleaner:
+                    text = cleaner.feed(text)
+                    if chunk.get('done'):
+                        text += cleaner.flush()
+                if text:
+                    yield text
+
+    def _build_request_data(self, prompt, stream, **kwargs):
+        """构造 /api/generate 的请求体"""
         # 初始化data时直接包含options字典
         data = {
             "model": self.model_name,
             "prompt": prompt,
-            "stream": False,  # 强制关闭流式响应
+            "stream": stream,
             "context": self.context,
             "options": {}  # 确保options始终存在且是字典
         }
@@ -52,7 +131,7 @@ class OllamaClient:
             input_tokens = self._estimate_tokens(prompt)
             max_tokens = data['options'].get('max_tokens', 2048)
             total_needed = input_tokens + max_tokens + 512  # 添加缓冲
-            num_ctx = max(4096, min(32768, total_needed))
+            num_ctx = max(4096, min(MAX_CONTEXT_LENGTH, total_needed))
 
             # 调试信息
             print(f"[调试] 动态上下文配置: 输入={input_tokens} tokens | "
@@ -65,30 +144,12 @@ class OllamaClient:
         if 'num_ctx' not in data['options']:
             data['options']['num_ctx'] = num_ctx
 
-        try:
-            response = requests.post(f"{self.base_url}/api/generate",
-                                     json=data)
-            response.raise_for_status()
-        except Exception as e:
-            error_msg = e.response.text if hasattr(e, 'response') and e.response else str(e)
-            raise Exception(f"Ollama请求失败: {error_msg}")
-
-        # 处理响应
-        try:
-            result = response.json()
-            response_text = result.get('response', '')
-            # 更新上下文
-            self.context = result.get('context', [])
+        return data
 
-            # 移除<think>标签（如果启用）
-            if self.remove_think_tags:
-                response_text = re.sub(r'<!--.*?-->', '', response_text, flags=re.DOTALL)  # 移除HTML注释
-                response_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.DOTALL)
-                response_text = re.sub(r'\n\s*\n', '\n\n', response_text).strip()
-
-            return response_text
-        except json.JSONDecodeError as e:
-            raise Exception(f"JSON解析失败: {str(e)}")
+    def _update_context(self, context):
+        """保存服务端返回的上下文，只保留最后一个上下文窗口的 token，避免多轮对话后无限增长"""
+        limit = self.default_context_length or MAX_CONTEXT_LENGTH
+        self.context = context[-limit:] if len(context) > limit else context
 
     def reset_context(self):
         """重置对话上下文"""
@@ -101,8 +162,94 @@ class OllamaClient:
     def _estimate_tokens(self, text, is_chinese=True):
         """估算文本的token数量（中文字符≈1.7 tokens）"""
         if is_chinese:
-            return math.ceil(len(text) * 1.7)
-        return len(text.split())  # 英文按单词估算
+            return (len(text) * 17 + 9) // 10  # 整数运算向上取整，等价于 ceil(len * 1.7)
+        return sum(1 for _ in _WORD_RE.finditer(text))  # 英文按单词估算，不生成单词列表
+
+
+class _StreamingTagStripper:
+    """
+    增量地移除 opening...closing 块，结果与对整段文本执行 re.sub(opening.*?closing, '', DOTALL) 相同：
+    块内文本一直缓存到出现结束标签为止；流结束时仍未闭合的块按原样输出（正则同样不会匹配它）
+    """
+
+    def __init__(self, opening, closing):
+        self._opening = opening
+        self._closing = closing
+        self._buffer = ""
+        self._inside = False  # 是否位于未闭合的块中（缓冲区以开始标签开头）
+        self._scanned = 0  # 块内已查找过结束标签的位置，避免重复扫描
+
+    def feed(self, text):
+        """追加一段文本，返回可以安全输出的部分"""
+        self._buffer += text
+        output = []
+        while True:
+            if self._inside:
+                end = self._buffer.find(self._closing, self._scanned)
+                if end == -1:
+                    self._scanned = max(len(self._opening), len(self._buffer) - len(self._closing) + 1)
+                    break
+                self._buffer = self._buffer[end + len(self._closing):]
+                self._inside = False
+                continue
+
+            start = self._buffer.find(self._opening)
+            if start != -1:
+                output.append(self._buffer[:start])
+                self._buffer = self._buffer[start:]
+                self._inside = True
+                self._scanned = len(self._opening)
+                continue
+
+            # 尾部可能是被截断的开始标签，暂不输出
+            keep = 0
+            for size in range(len(self._opening) - 1, 0, -1):
+                if self._buffer.endswith(self._opening[:size]):
+                    keep = size
+                    break
+            output.append(self._buffer[:len(self._buffer) - keep])
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            break
+        return "".join(output)
+
+    def flush(self):
+        """流结束时输出缓冲区剩余的文本（包括未闭合的块）"""
+        text = self._buffer
+        self._buffer = ""
+        self._inside = False
+        return text
+
+
+class _StreamingResponseCleaner:
+    """
+    流式版本的 generate 清理流程：依次移除 HTML 注释、<think> 块，把含空行的空白折叠为一个空行，并去掉首尾空白。
+    拼接全部输出与 generate 对完整回复的处理结果一致。
+    """
+
+    def __init__(self):
+        self._strippers = (_StreamingTagStripper("<!--", "-->"), _StreamingTagStripper("<think>", "</think>"))
+        self._pending_space = ""  # 末尾的连续空白，需等后续文本确定整段空白后再折叠
+        self._leading = True
+
+    def _collapse(self, text, final):
+        text = self._pending_space + text
+        body = text.rstrip()
+        self._pending_space = "" if final else text[len(body):]
+        if self._leading:
+            body = body.lstrip()
+            self._leading = not body
+        return _BLANK_LINES_RE.sub('\n\n', body)
+
+    def feed(self, text):
+        for stripper in self._strippers:
+            text = stripper.feed(text)
+        return self._collapse(text, final=False)
+
+    def flush(self):
+        text = ""
+        for stripper in self._strippers:
+            text = stripper.feed(text) + stripper.flush()
+        return self._collapse(text, final=True)
 
 
 # 测试代码
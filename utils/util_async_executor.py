@@ -2,7 +2,7 @@ import asyncio
 import time
 import signal
 import sys
-from typing import List, Callable, Any, Optional, Awaitable
+from typing import List, Callable, Any, Optional, Awaitable, Dict, Hashable
 from tqdm.asyncio import tqdm
 
 
@@ -23,9 +23,14 @@ async def run_limited_async_tasks(
     min_interval: float = 0.0,
     rate_limit_key: str = "default",
     desc: str = "Processing",
+    bin_of: Optional[Callable[[Any], Hashable]] = None,
+    bin_max_concurrent: Optional[Dict[Hashable, int]] = None,
 ) -> List[bool]:
     """
     自动支持 Ctrl+C 优雅关闭：收到 SIGINT 后，跳过未开始的任务，等待已开始的任务完成。
+    指定 bin_of 与 bin_max_concurrent 时按分组各自限制并发，避免耗时长的任务占满所有并发槽位；
+    不在 bin_max_concurrent 中的分组共用 max_concurrent。
+    每个分组由固定数量的 worker 从有界队列中取任务执行，同时存在的协程数与并发数相当，而不是与任务总数相当。
     """
     if not tasks:
         return []
@@ -63,7 +68,6 @@ async def run_limited_async_tasks(
         if not non_skipped:
             return [True] * len(tasks)
 
-        semaphore = asyncio.Semaphore(max_concurrent)
         lock_key = f"lock_{rate_limit_key}"
         time_key = f"time_{rate_limit_key}"
         if lock_key not in _RATE_LIMIT_LOCKS:
@@ -103,13 +107,12 @@ async def run_limited_async_tasks(
                 tqdm.write(f"[跳过] 因中断请求跳过任务: {task_info}")
                 success = False
             else:
-                async with semaphore:
-                    try:
-                        result = await task_func(task_item)
-                        success = bool(result)
-                    except Exception as e:
-                        tqdm.write(f"[错误] {task_info}: {e}")
-                        success = False
+                try:
+                    result = await task_func(task_item)
+                    success = bool(result)
+                except Exception as e:
+                    tqdm.write(f"[错误] {task_info}: {e}")
+                    success = False
 
             status = "✓" if success else "✗"
             pbar.set_postfix_str(f"{status} {task_info[:50]}")
@@ -117,8 +120,35 @@ async def run_limited_async_tasks(
             pbar.update(1)
             return success
 
-        coros = [_run_single(task, idx) for task, idx in zip(non_skipped, orig_indices)]
-        await asyncio.gather(*coros)
+        # 按分组拆分任务；worker 数即该分组的并发上限
+        bin_limits = bin_max_concurrent or {}
+        groups = {}
+        for task, idx in zip(non_skipped, orig_indices):
+            key = bin_of(task) if bin_of else None
+            if key not in bin_limits:
+                key = None
+            groups.setdefault(key, []).append((task, idx))
+
+        async def _worker(job_queue):
+            while True:
+                job = await job_queue.get()
+                if job is None:
+                    return
+                await _run_single(*job)
+
+        async def _feed(jobs, limit):
+            job_queue = asyncio.Queue(maxsize=limit * 2)
+            workers = [asyncio.create_task(_worker(job_queue)) for _ in range(limit)]
+            for job in jobs:
+                await job_queue.put(job)
+            for _ in workers:
+                await job_queue.put(None)
+            await asyncio.gather(*workers)
+
+        await asyncio.gather(*(
+            _feed(jobs, bin_limits.get(key, max_concurrent))
+            for key, jobs in groups.items()
+        ))
         pbar.close()
         # === 原有逻辑结束 ===
 
@@ -368,14 +368,18 @@ def get_report_list_with_cache(novel_name, chapter_filename):
         return []
 
 
+_HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
+
+
 def filter_think_tags(text: str) -> str:
     """
     过滤掉 <think>...</think> 标签及其内容。
     """
-    import re
-    filtered_text = re.sub(r'<!--.*?-->', '', text, flags=re.DOTALL) # 移除HTML注释
-    filtered_text = re.sub(r'<think>.*?</think>', '', filtered_text, flags=re.DOTALL)
-    filtered_text = re.sub(r'\n\s*\n', '\n\n', filtered_text).strip()
+    filtered_text = _HTML_COMMENT_RE.sub('', text) # 移除HTML注释
+    filtered_text = _THINK_RE.sub('', filtered_text)
+    filtered_text = _BLANK_LINES_RE.sub('\n\n', filtered_text).strip()
     return filtered_text
 
 
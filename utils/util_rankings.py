@@ -17,6 +17,12 @@ from utils.util_chapter import NOVELS_BASE_DIR
 
 RANKING_FILE = os.path.join(PROJECT_ROOT, "scraped_data", "所有分类月票榜汇总.txt")
 
+# 月票榜中的分类标题行（==== 分类 ====）与 “1. 《书名》 - ...” 格式的榜单行
+RANKING_LINE_PATTERN = re.compile(
+    r'^[^\S\n]*((?=====).*====)[^\S\n]*$|^[^\S\n]*\d+\.[^\S\n]*《(.+?)》[^\S\n]*-',
+    re.MULTILINE
+)
+
 
 # --- 原有逻辑保持不变 ---
 def parse_ranking_file(filepath=RANKING_FILE):
@@ -128,22 +134,21 @@ def extract_top_novels_from_ranking(top_n: int = 10) -> List[str]:
         return []
 
     novel_names = []
-    lines = ranking_content.splitlines()
+    seen = set()  # 与 novel_names 并行，用于 O(1) 去重
     in_any_category = False
 
-    for line in lines:
-        line = line.strip()
-        if line.startswith("====") and line.endswith("===="):
+    # 一次 finditer 扫描全文：group 1 为分类标题行，group 2 为榜单中的书名
+    for match in RANKING_LINE_PATTERN.finditer(ranking_content):
+        if match.group(2) is None:
             in_any_category = True
             continue
         if in_any_category:
-            match = re.match(r'^\s*\d+\.\s*《(.+?)》\s*-', line)
-            if match:
-                novel_name = match.group(1).strip()
-                if novel_name and novel_name not in novel_names:
-                    novel_names.append(novel_name)
-                if len(novel_names) >= top_n:
-                    break
+            novel_name = match.group(2).strip()
+            if novel_name and novel_name not in seen:
+                seen.add(novel_name)
+                novel_names.append(novel_name)
+            if len(novel_names) >= top_n:
+                break
 
     return novel_names[:top_n]
 